@@ -0,0 +1,184 @@
+from flappybirdenv.flappybird import FlappyBird
+from flappybirdenv.flappybird_vector import VectorFlappyBird
+from dqn import Dqn
+from replay import ReplayMemory, PrioritizedReplayMemory
+import numpy as np
+import argparse
+import json
+import os
+import pygame
+import subprocess
+import time
+import yaml
+from datetime import datetime
+
+
+# Fixed-seed benchmarks of the environment, the learner, the replay memory and the greedy policy. Results are
+# written as JSON so runs can be compared across commits, e.g. python benchmark.py --output bench.json
+
+
+def current_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def percentiles(samples):
+    return {f"p{p}": float(np.percentile(samples, p)) for p in (50, 90, 99)}
+
+
+# env frames per second with a seeded random policy, over one game per seed
+def bench_env(seeds, frames, headless):
+    env = FlappyBird(headless=headless, seed=seeds[0])
+    total = 0
+    start = time.perf_counter()
+    for seed in seeds:
+        env.resetGame(seed)
+        rng = np.random.default_rng(seed)
+        for _ in range(frames):
+            gameOver, _, _ = env.step(int(rng.integers(0, 10) == 1))
+            env.getGameState()
+            total += 1
+            if gameOver:
+                env.resetGame()
+    return total / (time.perf_counter() - start)
+
+
+# frames per second of the vectorized env, counting every game
+def bench_vector_env(seed, numEnvs, steps):
+    env = VectorFlappyBird(numEnvs, seed=seed)
+    rng = np.random.default_rng(seed)
+    actions = (rng.integers(0, 10, size=(steps, numEnvs)) == 1).astype(np.int8)
+    start = time.perf_counter()
+    for i in range(steps):
+        env.step(actions[i])
+    return numEnvs * steps / (time.perf_counter() - start)
+
+
+# fill a memory with random transitions without going through the per-frame path
+def fill_memory(memory, count, rng, chunk=100000):
+    while count > 0:
+        n = min(chunk, count)
+        gameOvers = rng.random(n) < 0.01
+        memory.addBatch(rng.random((n, 5), dtype=np.float32) * 500, rng.integers(0, 2, n), np.full(n, 0.1),
+                        rng.random((n, 5), dtype=np.float32) * 500, gameOvers, 0.99 * ~gameOvers)
+        count -= n
+
+
+# gradient updates (sampling included) per second for several batch sizes
+def bench_updates(parameters, seed, batchSizes, updates):
+    results = {}
+    for batchSize in batchSizes:
+        dqn = Dqn(hidden_nodes=parameters["hidden_nodes"], lr=parameters["learningRate"], maxMemory=100000,
+                  discount=parameters["gamma"], ddqn=True, seed=seed)
+        fill_memory(dqn.memory, 100000, np.random.default_rng(seed))
+
+        # the first call traces the graph
+        dqn.train_batch(dqn.getBatch(batchSize))
+        start = time.perf_counter()
+        for _ in range(updates):
+            dqn.train_batch(dqn.getBatch(batchSize))
+        results[batchSize] = updates / (time.perf_counter() - start)
+    return results
+
+
+# latency of a single greedy decision, in microseconds
+def bench_action_latency(dqn, seed, decisions):
+    states = np.random.default_rng(seed).random((decisions, 1, 5), dtype=np.float32) * 500
+    policy = dqn.getPolicy()
+    samples = []
+    for state in states:
+        start = time.perf_counter()
+        policy.act(state)
+        samples.append((time.perf_counter() - start) * 1e6)
+    return percentiles(samples)
+
+
+# microseconds per insert into a full memory, and per sample (plus priority update) of a batch of 64
+def bench_replay(seed, capacities, operations):
+    results = {}
+    z = np.zeros(5, dtype=np.float32)
+    for name, memoryClass in (("uniform", ReplayMemory), ("prioritized", PrioritizedReplayMemory)):
+        for capacity in capacities:
+            memory = memoryClass(capacity, seed=seed)
+            fill_memory(memory, capacity, np.random.default_rng(seed))
+
+            start = time.perf_counter()
+            for _ in range(operations):
+                memory.add(z, 1, 0.1, z, False, 0.99)
+            insert = (time.perf_counter() - start) / operations * 1e6
+
+            tdErrors = np.random.default_rng(seed).random(64)
+            start = time.perf_counter()
+            for _ in range(operations):
+                indices, _, _ = memory.sample(64)
+                memory.updatePriorities(indices, tdErrors)
+            sample = (time.perf_counter() - start) / operations * 1e6
+
+            results[f"{name}_{capacity}"] = {"insert_us": insert, "sample_us": sample}
+    return results
+
+
+# pipes passed by the greedy policy, one game per seed
+def bench_policy(dqn, seeds, maxFrames):
+    env = FlappyBird(headless=True)
+    policy = dqn.getPolicy()
+    scores = []
+    for seed in seeds:
+        env.resetGame(seed)
+        for _ in range(maxFrames):
+            gameOver, _, _ = env.step(policy.act(env.getGameState()))
+            if gameOver:
+                break
+        scores.append(env.score)
+    return {"mean_pipes_passed": float(np.mean(scores)), "scores": scores}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Flappy Bird DQN benchmarks")
+    parser.add_argument("--output", default=f"./logs/bench{datetime.now().strftime('%m-%d--%H-%M')}.json")
+    parser.add_argument("--weights", default=None, help="weights to evaluate the greedy policy with")
+    parser.add_argument("--seeds", type=int, nargs="+", default=[0, 1, 2, 3, 4])
+    parser.add_argument("--frames", type=int, default=2000, help="frames per seed for the headless env")
+    parser.add_argument("--rendered-frames", type=int, default=60, help="frames per seed for the rendered env")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[32, 64, 256, 1024])
+    parser.add_argument("--updates", type=int, default=200)
+    parser.add_argument("--capacities", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--replay-operations", type=int, default=2000)
+    parser.add_argument("--max-frames", type=int, default=10000, help="frame limit per greedy game")
+    args = parser.parse_args()
+
+    with open("hyperparameters.yml", "r") as parameters_file:
+        parameters = yaml.safe_load(parameters_file)
+    seed = args.seeds[0]
+
+    results = {"commit": current_commit(), "time": datetime.now().isoformat(), "seeds": args.seeds}
+
+    # the rendered env needs a display and is capped at 30 FPS, so it runs first and only briefly
+    try:
+        results["env_steps_per_sec_rendered"] = bench_env(args.seeds, args.rendered_frames, headless=False)
+    except pygame.error as e:
+        results["env_steps_per_sec_rendered"] = None
+        print(f"skipping the rendered env: {e}")
+    results["env_steps_per_sec_headless"] = bench_env(args.seeds, args.frames, headless=True)
+    results["vector_env_steps_per_sec"] = bench_vector_env(seed, 10000, 100)
+
+    results["updates_per_sec"] = bench_updates(parameters, seed, args.batch_sizes, args.updates)
+
+    dqn = Dqn(hidden_nodes=parameters["hidden_nodes"], lr=parameters["learningRate"], maxMemory=1,
+              discount=parameters["gamma"], seed=seed)
+    if args.weights is not None:
+        dqn.load_weights(args.weights)
+    results["action_latency_us"] = bench_action_latency(dqn, seed, 10000)
+    results["replay"] = bench_replay(seed, args.capacities, args.replay_operations)
+    results["policy"] = bench_policy(dqn, args.seeds, args.max_frames)
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,24 @@
 import keras
 keras.utils.disable_interactive_logging()
 
+# precision is a keras dtype policy for the hidden layers: float32, mixed_float16 or mixed_bfloat16. Mixed
+# precision keeps the variables in float32 and computes in 16 bits, the output layer always computes in float32
+# so the Q-values and the loss stay in float32.
+PRECISIONS = ("float32", "mixed_float16", "mixed_bfloat16")
+
 class Brain():
-    def __init__(self, hidden_nodes, input_size, output_size, lr):
+    def __init__(self, hidden_nodes, input_size, output_size, lr, precision="float32"):
+        if precision not in PRECISIONS:
+            raise ValueError(f"unknown precision: {precision}")
         self.numInputs = input_size
         self.numOutputs = output_size
         self.learningRate = lr
 
         self.model = keras.models.Sequential()
-        self.model.add(keras.layers.Dense(units=hidden_nodes*2, activation='relu', input_shape=(self.numInputs, )))
-        self.model.add(keras.layers.Dense(units=hidden_nodes, activation='relu'))
-        self.model.add(keras.layers.Dense(units=self.numOutputs))
+        self.model.add(keras.layers.Dense(units=hidden_nodes*2, activation='relu', input_shape=(self.numInputs, ),
+                                          dtype=precision))
+        self.model.add(keras.layers.Dense(units=hidden_nodes, activation='relu', dtype=precision))
+        self.model.add(keras.layers.Dense(units=self.numOutputs, dtype="float32"))
 
     # save model weights
     def save_weights(self, fname):
@@ -0,0 +1,94 @@
+import json
+import os
+import shutil
+import threading
+import numpy as np
+import tensorflow as tf
+
+
+CHECKPOINT_PREFIX = "ckpt-"
+STAGING_SUFFIX = ".tmp"
+
+
+# Resumable checkpoints of a training run. Every checkpoint is a directory holding a tf.train.Checkpoint of the
+# networks and the optimizer, one .npy file per replay array, and a JSON file with everything else (epoch,
+# epsilon, counters, random generator states). The TensorFlow checkpoint is written from the caller's thread
+# so the variables are consistent, the rest is written by a background thread into a staging directory that
+# is renamed once complete, so a pre-empted save never leaves a partial checkpoint behind. Only the newest
+# keep checkpoints are kept.
+class Checkpointer():
+    def __init__(self, directory, keep=3):
+        if keep < 1:
+            raise ValueError("at least one checkpoint must be kept, disable them with checkpoint_every: 0 instead")
+        self.directory = directory
+        self.keep = keep
+        self.thread = None
+        self.error = None
+        os.makedirs(directory, exist_ok=True)
+
+    # save a checkpoint for step. trackables are the TensorFlow objects to checkpoint, arrays are saved as .npy
+    # files (they must not be modified afterwards, pass copies) and metadata must be JSON serializable.
+    def save(self, step, trackables, arrays, metadata):
+        self.wait()
+
+        staging = os.path.join(self.directory, f"{CHECKPOINT_PREFIX}{step}{STAGING_SUFFIX}")
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        tf.train.Checkpoint(**trackables).write(os.path.join(staging, "variables"))
+
+        self.thread = threading.Thread(target=self._write, args=(step, staging, arrays, metadata), daemon=True)
+        self.thread.start()
+
+    def _write(self, step, staging, arrays, metadata):
+        try:
+            for name, array in arrays.items():
+                np.save(os.path.join(staging, f"{name}.npy"), array)
+            with open(os.path.join(staging, "metadata.json"), "w") as f:
+                json.dump(metadata, f)
+
+            final = os.path.join(self.directory, f"{CHECKPOINT_PREFIX}{step}")
+            shutil.rmtree(final, ignore_errors=True)
+            os.rename(staging, final)
+
+            for old in self.checkpoints()[:-self.keep]:
+                shutil.rmtree(old, ignore_errors=True)
+        except Exception as e:
+            self.error = e
+
+    # wait for the save in progress, raising its error if it failed
+    def wait(self):
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    # complete checkpoints, oldest first
+    def checkpoints(self):
+        steps = []
+        for name in os.listdir(self.directory):
+            if name.startswith(CHECKPOINT_PREFIX) and not name.endswith(STAGING_SUFFIX):
+                steps.append(int(name[len(CHECKPOINT_PREFIX):]))
+        return [os.path.join(self.directory, f"{CHECKPOINT_PREFIX}{step}") for step in sorted(steps)]
+
+    def latest(self):
+        checkpoints = self.checkpoints()
+        return checkpoints[-1] if checkpoints else None
+
+    # Restore the TensorFlow objects of a checkpoint, returns (arrays, metadata). The arrays are memory mapped
+    # from the .npy files.
+    def load(self, path, trackables):
+        tf.train.Checkpoint(**trackables).read(os.path.join(path, "variables")).assert_consumed()
+
+        arrays = {}
+        for name in os.listdir(path):
+            if name.endswith(".npy"):
+                arrays[name[:-4]] = np.load(os.path.join(path, name), mmap_mode="r")
+        with open(os.path.join(path, "metadata.json"), "r") as f:
+            metadata = json.load(f)
+        return arrays, metadata
+
+    # wait for the last save, raising its error if it failed
+    def close(self):
+        self.wait()
@@ -0,0 +1,271 @@
+import multiprocessing as mp
+import queue
+import time
+import numpy as np
+from multiprocessing import shared_memory
+from inference import NumpyBrain
+from replay import NStepBuffer
+
+
+# Network weights shared between the learner and the actors through shared memory. The version counter works
+# as a seqlock: it is odd while the learner is writing, so readers can detect torn copies and retry.
+class SharedWeights():
+    def __init__(self, shapes, version, name=None):
+        self.shapes = shapes
+        self.sizes = [int(np.prod(shape)) for shape in shapes]
+        self.version = version
+
+        nbytes = sum(self.sizes) * np.dtype(np.float32).itemsize
+        if name is None:
+            self.memory = shared_memory.SharedMemory(create=True, size=nbytes)
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+        self.buffer = np.ndarray((sum(self.sizes),), dtype=np.float32, buffer=self.memory.buf)
+
+    # copy the weights into shared memory (learner side)
+    def publish(self, weights):
+        self.version.value += 1
+        self.buffer[:] = np.concatenate([np.ravel(w) for w in weights])
+        self.version.value += 1
+
+    # returns (weights, version) if the weights are newer than knownVersion, otherwise None (actor side)
+    def read(self, knownVersion):
+        while True:
+            before = self.version.value
+            if before == knownVersion:
+                return None
+            if before % 2 == 1:
+                continue
+            flat = self.buffer.copy()
+            if self.version.value == before:
+                break
+
+        weights = []
+        offset = 0
+        for shape, size in zip(self.shapes, self.sizes):
+            weights.append(flat[offset:offset + size].reshape(shape))
+            offset += size
+        return weights, before
+
+    def close(self, unlink=False):
+        self.buffer = None
+        self.memory.close()
+        if unlink:
+            self.memory.unlink()
+
+
+# put an item on a queue, giving up if the actor is asked to stop while the queue is full
+def _put(q, item, stop):
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+# Actor process: plays headless games with a local NumPy copy of the network and sends the transitions to the
+# learner in chunks, together with the result of every finished game. In n-step mode the actor computes the
+# returns itself, bootstrapping lambda-returns with its local network.
+def runActor(actorId, epsilon, seed, weightsName, shapes, version, transitionQueue, episodeQueue, stop, chunkSize,
+             gamma, nStep, nStepLambda, nStepWindow, actionRepeat):
+    from flappybirdenv.flappybird import FlappyBird
+    from flappybirdenv.flappybird_rewards import getReward
+
+    env = FlappyBird(headless=True, seed=seed)
+    rng = np.random.default_rng(seed)
+    sharedWeights = SharedWeights(shapes, version, name=weightsName)
+    policy = NumpyBrain()
+
+    # chunk of transitions waiting to be sent
+    states = np.zeros((chunkSize, 5), dtype=np.float32)
+    actions = np.zeros(chunkSize, dtype=np.int8)
+    rewards = np.zeros(chunkSize, dtype=np.float32)
+    nextStates = np.zeros((chunkSize, 5), dtype=np.float32)
+    gameOvers = np.zeros(chunkSize, dtype=bool)
+    discounts = np.zeros(chunkSize, dtype=np.float32)
+    count = 0
+    frames = 0
+
+    nStepBuffer = None
+    if nStep > 1:
+        nStepBuffer = NStepBuffer(nStep, gamma, lam=nStepLambda, window=nStepWindow,
+                                  valueFn=lambda s: policy.predictBatch(s).max(axis=1))
+
+    while not stop.is_set():
+        env.resetGame()
+        currentState = np.array(env.getGameState(), dtype=np.float32)
+        totReward = 0
+        pipes_passed = 0
+        portals = 0
+        gameFrames = 0
+        start = time.perf_counter()
+
+        gameOver = False
+        while not gameOver and not stop.is_set():
+            # check for new weights once per chunk
+            if frames % chunkSize == 0:
+                update = sharedWeights.read(policy.version)
+                if update is not None:
+                    policy.setWeights(*update)
+            frames += 1
+
+            # same epsilon greedy exploration as Agent.train()
+            if rng.random() <= epsilon:
+                action = 0 if rng.integers(0, 10) != 1 else 1
+            else:
+                action = policy.act(currentState)
+
+            # the action is repeated for actionRepeat frames, like in Agent.train()
+            reward = 0
+            for _ in range(actionRepeat):
+                gameOver, gotReward, portal_reward = env.step(action)
+                reward += getReward(gameOver, gotReward, portal_reward)
+                if gotReward:
+                    pipes_passed += 1
+                if portal_reward:
+                    portals += 1
+                gameFrames += 1
+                if gameOver:
+                    break
+            nextState = np.array(env.getGameState(), dtype=np.float32)
+            totReward += reward
+
+            if nStepBuffer is None:
+                transitions = [(currentState, action, reward, nextState, gameOver, gamma * (1 - gameOver))]
+            else:
+                transitions = nStepBuffer.add(currentState, action, reward, nextState, gameOver)
+                transitions = zip(*transitions) if transitions is not None else ()
+
+            for transition in transitions:
+                states[count], actions[count], rewards[count], nextStates[count], gameOvers[count], discounts[count] = transition
+                count += 1
+                if count == chunkSize:
+                    _put(transitionQueue, (states.copy(), actions.copy(), rewards.copy(), nextStates.copy(),
+                                           gameOvers.copy(), discounts.copy()), stop)
+                    count = 0
+
+            currentState = nextState
+
+        if gameOver:
+            _put(episodeQueue, (actorId, epsilon, totReward, pipes_passed, gameFrames, portals,
+                                time.perf_counter() - start), stop)
+
+    # the learner stops reading once it is done, so don't wait for unsent items when exiting
+    transitionQueue.cancel_join_thread()
+    episodeQueue.cancel_join_thread()
+    sharedWeights.close()
+
+
+# Ape-X style execution: several actor processes play the game while the learner, in this process, owns the Dqn
+# and its replay memory, trains on the streamed transitions and broadcasts its weights back periodically.
+class ActorLearner():
+    def __init__(self, agent):
+        self.agent = agent
+        self.numActors = agent.num_actors
+
+        # spawn, so the actors don't inherit the learner's TensorFlow state
+        self.context = mp.get_context("spawn")
+        self.transitionQueue = self.context.Queue(maxsize=4 * self.numActors)
+        self.episodeQueue = self.context.Queue()
+        self.stop = self.context.Event()
+
+        weights = agent.DQN.model.get_weights()
+        self.version = self.context.Value("q", 0)
+        self.sharedWeights = SharedWeights([w.shape for w in weights], self.version)
+        self.sharedWeights.publish(weights)
+        self.publishedVersion = agent.DQN.weightsVersion
+
+        self.actors = []
+
+    # each actor explores with its own fixed epsilon, from agent.actor_epsilon down to almost greedy
+    def actorEpsilon(self, actorId):
+        if self.numActors == 1:
+            return self.agent.actor_epsilon
+        return self.agent.actor_epsilon ** (1 + self.agent.actor_epsilon_alpha * actorId / (self.numActors - 1))
+
+    # every actor gets its own seed derived from the agent's one
+    def actorSeed(self, actorId):
+        if self.agent.seed is None:
+            return None
+        return self.agent.seed + actorId + 1
+
+    def _startActors(self):
+        for actorId in range(self.numActors):
+            actor = self.context.Process(
+                target=runActor, daemon=True,
+                args=(actorId, self.actorEpsilon(actorId), self.actorSeed(actorId), self.sharedWeights.memory.name,
+                      self.sharedWeights.shapes, self.version, self.transitionQueue, self.episodeQueue, self.stop,
+                      self.agent.actor_chunk_size, self.agent.gamma, self.agent.n_step, self.agent.n_step_lambda,
+                      self.agent.n_step_window, self.agent.action_repeat))
+            actor.start()
+            self.actors.append(actor)
+
+    def _stopActors(self):
+        self.stop.set()
+        for actor in self.actors:
+            actor.join(timeout=5)
+            if actor.is_alive():
+                actor.terminate()
+        self.sharedWeights.close(unlink=True)
+
+    # add a chunk of transitions to memory and run the training scheduled for those frames
+    def _learn(self, chunk):
+        with self.agent.timer.phase("remember"):
+            self.agent.DQN.rememberBatch(*chunk)
+        for _ in range(len(chunk[1])):
+            self.agent.trainStep()
+
+        if self.agent.DQN.weightsVersion - self.publishedVersion >= self.agent.weight_sync_interval:
+            with self.agent.timer.phase("publish_weights"):
+                self.sharedWeights.publish(self.agent.DQN.model.get_weights())
+            self.publishedVersion = self.agent.DQN.weightsVersion
+
+    # log the games finished by the actors, and save the weights every 100 games, up to maxEpochs games
+    def _logEpisodes(self, maxEpochs):
+        while self.agent.epoch < maxEpochs:
+            try:
+                actorId, epsilon, totReward, pipes_passed, frames, portals, seconds = self.episodeQueue.get_nowait()
+            except queue.Empty:
+                return
+            self.agent.epoch += 1
+            self.agent.log_default(self.agent.epoch, totReward, epsilon, pipes_passed, frames, portals, seconds)
+            if self.agent.epoch % 100 == 0:
+                with self.agent.timer.phase("save_weights"):
+                    self.agent.DQN.save_weights(self.agent.weights_file_name)
+            if self.agent.checkpoint_every and self.agent.epoch % self.agent.checkpoint_every == 0:
+                with self.agent.timer.phase("checkpoint"):
+                    self.agent.saveCheckpoint()
+
+            # the learner's phases and profile window follow the games finished by the actors
+            self.agent.timer.episodeDone(self.agent.epoch)
+            self.agent.timer.episodeStarted(self.agent.epoch + 1)
+
+    def run(self, maxEpochs=50000):
+        self._startActors()
+        self.agent.timer.episodeStarted(self.agent.epoch + 1)
+        try:
+            while self.agent.epoch < maxEpochs:
+                try:
+                    self._learn(self.transitionQueue.get(timeout=0.1))
+                except queue.Empty:
+                    pass
+                self._logEpisodes(maxEpochs)
+        finally:
+            self._stopActors()
+            self.agent.DQN.memory.close()
+            self.agent.timer.close()
+            self.agent.metrics.close()
+            # last, so everything else is closed if the final checkpoint failed
+            self.agent.checkpointer.close()
+
+
+if __name__ == "__main__":
+    import yaml
+    from main import Agent
+    with open("hyperparameters.yml", "r") as parameters_file:
+        parameters = yaml.safe_load(parameters_file)
+    # the learner never plays, its game doesn't need a window
+    parameters["headless"] = True
+    ActorLearner(Agent(parameters)).run()
@@ -2,110 +2,161 @@ from random import sample
 import numpy as np
 import tensorflow as tf
 from brain import Brain
+from replay import ReplayMemory, PrioritizedReplayMemory, MemmapReplayMemory, NStepBuffer
+from inference import NumpyBrain
 import keras
 import numpy
 keras.utils.disable_interactive_logging()
 
 class Dqn():
-    def __init__(self, hidden_nodes, lr, maxMemory, discount):
+    def __init__(self, hidden_nodes, lr, maxMemory, discount, prioritized=False, alpha=0.6, beta=0.4, betaIncrement=0.0001,
+                 ddqn=False, jit_compile=False, nStep=1, nStepLambda=None, nStepWindow=256, replayBackend="memory",
+                 replayPath=None, replayOverwrite=False, precision="float32", seed=None):
         self.maxMemory = maxMemory
         self.discount = discount
-        self.memory = list()
+        self.ddqn = ddqn
+        if replayBackend not in ("memory", "memmap"):
+            raise ValueError(f"unknown replay backend: {replayBackend}")
+        if replayBackend == "memmap":
+            if prioritized:
+                raise ValueError("prioritized replay needs the in-memory replay backend")
+            self.memory = MemmapReplayMemory(maxMemory, replayPath, overwrite=replayOverwrite, seed=seed)
+        elif prioritized:
+            self.memory = PrioritizedReplayMemory(maxMemory, alpha=alpha, beta=beta, betaIncrement=betaIncrement, seed=seed)
+        else:
+            self.memory = ReplayMemory(maxMemory, seed=seed)
 
-        self.model = Brain(hidden_nodes, 5, 2, lr).model
-        self.target_dqn = Brain(hidden_nodes, 5, 2, lr).model
-        self.loss_fn = keras.losses.MeanSquaredError()
+        self.model = Brain(hidden_nodes, 5, 2, lr, precision).model
+        self.target_dqn = Brain(hidden_nodes, 5, 2, lr, precision).model
         self.optimizer = keras.optimizers.AdamW(learning_rate=lr, amsgrad=True)
+        # float16 gradients underflow without loss scaling, bfloat16 has the range of float32 and doesn't need it
+        if precision == "mixed_float16":
+            self.optimizer = keras.optimizers.LossScaleOptimizer(self.optimizer)
+        # create the optimizer's variables now, so checkpoints can be restored before the first update
+        self.optimizer.build(self.model.trainable_variables)
+
+        # compiled training step and target network updates, optionally with XLA. The target updates assign
+        # the variables in place, tau is a tensor so changing it doesn't retrace the graph.
+        self.update = tf.function(self._update, jit_compile=jit_compile)
+        self.hardUpdate = tf.function(self._hardUpdate, jit_compile=jit_compile)
+        self.softUpdate = tf.function(self._softUpdate, input_signature=[tf.TensorSpec([], tf.float32)],
+                                      jit_compile=jit_compile)
         self.update_target_dqn()
 
-    # Getting batches of inputs and targets
-    def getBatch(self, batchSize, ddqn=False):
+        # NumPy copy of the main network for acting, only refreshed when the weights have changed
+        self.weightsVersion = 0
+        self.policy = NumpyBrain()
+
+        # transitions given to remember() are turned into n-step ones before being stored
+        self.nStep = None
+        if nStep > 1:
+            self.nStep = NStepBuffer(nStep, discount, lam=nStepLambda, valueFn=self.values, window=nStepWindow)
+
+    # Sample a batch of transitions from memory. Returns the sampled indices and the arrays
+    # (states, actions, rewards, nextStates, discounts, weights), or None if there aren't enough transitions yet.
+    def getBatch(self, batchSize):
         if len(self.memory) < batchSize:
-            return None, None
-
-        # Randomly sample batch indices
-        indices = np.random.randint(0, len(self.memory), size=batchSize)
-        # batch = sample(self.memory, batchSize)
-        # transitions, gameOvers = zip(*batch)
-        #
-        # currentState, actions, rewards, nextStates = zip(*transitions)
-
-        # Extract data and convert to tensors
-        inputs = tf.convert_to_tensor([tf.squeeze(self.memory[idx][0][0]) for idx in indices], dtype=tf.float32)
-        actions = tf.convert_to_tensor([self.memory[idx][0][1] for idx in indices], dtype=tf.int32)
-        rewards = tf.convert_to_tensor([self.memory[idx][0][2] for idx in indices], dtype=tf.float32)
-        nextStates = tf.convert_to_tensor([tf.squeeze(self.memory[idx][0][3]) for idx in indices], dtype=tf.float32)
-        gameOvers = tf.convert_to_tensor([self.memory[idx][1] for idx in indices], dtype=tf.float32)
-
-        # # Reshape inputs and nextStates according to model's input shape
-        # expected_shape = self.model.input_shape[1:]
-        # inputs = tf.reshape(inputs, (batchSize,) + expected_shape)
-        # nextStates = tf.reshape(nextStates, (batchSize,) + expected_shape)
-
-        # Batch predictions for inputs and nextStates
-        currentQValues = self.model(inputs, training=False)
-        nextQValues = self.model(nextStates, training=False)
-
-        # if it's a DDQN model, use the best action according to the revised Bellman equation
-        if ddqn:
-            bestActions = tf.argmax(nextQValues, axis=1, output_type=tf.int32)
-            nextQTargetValues = self.target_dqn(nextStates, training=False)
-            targetQValues = rewards + (1 - gameOvers) * self.discount * tf.gather_nd(
-                nextQTargetValues, tf.stack([tf.cast(tf.range(batchSize), dtype=tf.int32), bestActions], axis=1)
-            )
-        # Otherwise, use the traditional equation
-        else:
-            targetQValues = rewards + (1 - gameOvers) * self.discount * tf.reduce_max(nextQValues, axis=1)
+            return None
 
-        # Create targets tensor based on current Q-values and update specific actions
-        targets = tf.identity(currentQValues)
-        indices = tf.stack([tf.range(batchSize, dtype=tf.int32), actions], axis=1)
-        targets = tf.tensor_scatter_nd_update(targets, indices, targetQValues)
+        sampleIndices, transitions, weights = self.memory.sample(batchSize)
+        states, actions, rewards, nextStates, _, discounts = transitions
+        if weights is None:
+            weights = np.ones(batchSize, dtype=np.float32)
 
-        return inputs, targets
+        return sampleIndices, (states, actions, rewards, nextStates, discounts, weights)
 
+    # Compute the targets and take one optimizer step, all in a single graph. Returns the loss and the TD errors.
+    # The discounts are gamma * (1 - gameOver) for one step transitions, see NStepBuffer for n-step ones.
+    def _update(self, states, actions, rewards, nextStates, discounts, weights):
+        actions = tf.cast(actions, tf.int32)
 
-    # @tf.function
-    # def train_batch(self, inputs, targets):
-    #     self.model.train_on_batch(inputs.nmpy(), targets.numpy())
+        # if it's a DDQN model, the main network picks the best next action and the target network evaluates it
+        if self.ddqn:
+            bestActions = tf.argmax(self.model(nextStates, training=False), axis=1, output_type=tf.int32)
+            nextQValues = tf.gather(self.target_dqn(nextStates, training=False), bestActions, batch_dims=1)
+        # Otherwise, use the traditional equation
+        else:
+            nextQValues = tf.reduce_max(self.model(nextStates, training=False), axis=1)
+        targetQValues = tf.stop_gradient(rewards + discounts * nextQValues)
 
-    @tf.function
-    def train_batch(self, inputs, targets):
+        # Only the Q-values of the actions taken are trained, weighted by the importance sampling weights
         with tf.GradientTape() as tape:
-            predictions = self.model(inputs, training=True)
-            loss = self.loss_fn(targets, predictions)
-        gradients = tape.gradient(loss, self.model.trainable_variables)
+            currentQValues = tf.gather(self.model(states, training=True), actions, batch_dims=1)
+            tdErrors = targetQValues - currentQValues
+            loss = tf.reduce_mean(weights * tf.square(tdErrors))
+            scaledLoss = self.optimizer.scale_loss(loss)
+        gradients = tape.gradient(scaledLoss, self.model.trainable_variables)
         self.optimizer.apply_gradients(zip(gradients, self.model.trainable_variables))
 
-    # remember new experiences and remove the oldest if the memory is full
+        return loss, tdErrors
+
+    # Train on a batch from getBatch() and update the priorities of the sampled transitions with their TD errors
+    def train_batch(self, batch):
+        sampleIndices, tensors = batch
+        loss, tdErrors = self.update(*tensors)
+        self.weightsVersion += 1
+        tdErrors = tdErrors.numpy()
+        self.memory.updatePriorities(sampleIndices, tdErrors)
+        return loss.numpy(), tdErrors
+
+    # remember new experiences, the oldest one is overwritten if the memory is full. In n-step mode the
+    # experiences are stored once their returns are known.
     def remember(self, transition, gameOver):
-        self.memory.append([transition, gameOver])
-        if len(self.memory) > self.maxMemory:
-            # del self.memory[0]
-            self.memory.pop(0)
+        currentState, action, reward, nextState = transition
+        if self.nStep is None:
+            self.memory.add(currentState, action, reward, nextState, gameOver, self.discount * (1 - gameOver))
+            return
+
+        transitions = self.nStep.add(currentState, action, reward, nextState, gameOver)
+        if transitions is not None:
+            self.memory.addBatch(*transitions)
+
+    # remember a batch of experiences, given as arrays of states, actions, rewards, next states and game overs.
+    # The discounts default to the one step ones.
+    def rememberBatch(self, states, actions, rewards, nextStates, gameOvers, discounts=None):
+        if discounts is None:
+            discounts = self.discount * (1 - np.asarray(gameOvers, dtype=np.float32))
+        self.memory.addBatch(states, actions, rewards, nextStates, gameOvers, discounts)
+
+    # max Q-values of the main network for a batch of states, used to bootstrap lambda-returns
+    def values(self, states):
+        return self.getPolicy().predictBatch(states).max(axis=1)
+
+    def _hardUpdate(self):
+        for target_weight, main_weight in zip(self.target_dqn.weights, self.model.weights):
+            target_weight.assign(main_weight)
+
+    def _softUpdate(self, tau):
+        for target_weight, main_weight in zip(self.target_dqn.weights, self.model.weights):
+            target_weight.assign(tau * main_weight + (1 - tau) * target_weight)
 
     # Update target DQM weights to match main DQN (hard update)
     def update_target_dqn(self):
-        self.target_dqn.set_weights(self.model.get_weights())
+        self.hardUpdate()
 
-    # Soft update target DQN weights
+    # Soft update target DQN weights: target = tau * main + (1 - tau) * target
     def soft_update_target_dqn(self, tau: float):
-        main_network_weights = self.model.get_weights()
-        target_network_weights = self.target_dqn.get_weights()
+        self.softUpdate(np.float32(tau))
 
-        # Apply the soft update formula
-        new_weights = []
-        for target_weight, main_weight in zip(target_network_weights, main_network_weights):
-            updated_weight = tau * main_weight + (1 - tau) * target_weight
-            new_weights.append(updated_weight)
 
-        # Set the new weights to the target model
-        self.target_dqn.set_weights(new_weights)
+    # TensorFlow objects saved in checkpoints, see checkpoint.py
+    def trackables(self):
+        return {"model": self.model, "target_dqn": self.target_dqn, "optimizer": self.optimizer}
 
+    # call after the trackables have been restored from a checkpoint
+    def restored(self):
+        self.weightsVersion += 1
 
     def save_weights(self, fname):
         self.model.save_weights(fname)
 
 
     def load_weights(self, fname):
-        self.model.load_weights(fname)
\ No newline at end of file
+        self.model.load_weights(fname)
+        self.weightsVersion += 1
+
+    # returns the NumPy inference engine of the main network, exporting the weights again if they have changed
+    def getPolicy(self):
+        if self.policy.version != self.weightsVersion:
+            self.policy.setWeights(self.model.get_weights(), self.weightsVersion)
+        return self.policy
\ No newline at end of file
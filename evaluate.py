@@ -0,0 +1,124 @@
+from flappybirdenv.flappybird_vector import VectorFlappyBird
+from brain import Brain
+from inference import NumpyBrain, TFLiteBrain, int8ModelPath
+import numpy as np
+import argparse
+import json
+import os
+import time
+import yaml
+
+
+# Greedy evaluation of trained weights. Many games are played at once in VectorFlappyBird, headless and seeded,
+# with the NumPy copy of the network choosing the actions of all the games in one batch. Every game is played to
+# the end, or until max_frames, so long games aren't under-represented. Reports the distribution of the pipes
+# passed, the survival time in frames and the throughput.
+
+
+# Load the weights into the float32 NumPy policy, or a TensorFlow Lite model exported by quantize.py. With the int8
+# precision, the int8 model exported next to the weights is used.
+def loadPolicy(weights, hidden_nodes, precision="float32"):
+    if precision == "int8" and not weights.endswith(".tflite"):
+        weights = int8ModelPath(weights)
+        if not os.path.exists(weights):
+            raise FileNotFoundError(f"{weights} not found, export it with quantize.py")
+    if weights.endswith(".tflite"):
+        return TFLiteBrain(weights)
+    model = Brain(hidden_nodes, 5, 2, 0.001).model
+    model.load_weights(weights)
+    return NumpyBrain(model.get_weights())
+
+
+# Play numGames games with numEnvs games at a time, taking a greedy decision every actionRepeat frames.
+# Returns (scores, frames, truncated, decisions, seconds).
+def evaluate(policy, numGames, numEnvs, seed, actionRepeat=1, maxFrames=100000):
+    numEnvs = min(numEnvs, numGames)
+    env = VectorFlappyBird(numEnvs, seed=seed)
+    states = env.getGameStates()
+
+    scores = []
+    frames = []
+    truncated = []
+    started = numEnvs
+    active = np.ones(numEnvs, dtype=bool)
+    actions = np.zeros(numEnvs, dtype=np.int8)
+    decisions = 0
+    step = 0
+
+    start = time.perf_counter()
+    while active.any():
+        # every game decides on the same frames, games that just restarted decide right away
+        if step % actionRepeat == 0:
+            actions[:] = policy.actBatch(states)
+            decisions += int(active.sum())
+        step += 1
+
+        states, _, dones = env.step(actions)
+
+        # games reaching the frame limit are stopped and counted as truncated
+        limit = (env.frames >= maxFrames) & ~dones
+        finished = (dones | limit) & active
+        if finished.any():
+            rows = np.flatnonzero(finished)
+            scores.extend(np.where(dones[rows], env.finishedScores[rows], env.scores[rows]))
+            frames.extend(np.where(dones[rows], env.finishedFrames[rows], env.frames[rows]))
+            truncated.extend(limit[rows])
+            if limit.any():
+                states = env.reset(limit)
+
+            # the finished slots either start the remaining games or stop
+            for row in rows:
+                if started < numGames:
+                    started += 1
+                else:
+                    active[row] = False
+
+            if step % actionRepeat != 0:
+                restarted = finished & active
+                actions[restarted] = policy.actBatch(states[restarted])
+                decisions += int(restarted.sum())
+
+    seconds = time.perf_counter() - start
+    return np.array(scores), np.array(frames), np.array(truncated), decisions, seconds
+
+
+def summarize(scores, frames, truncated, decisions, seconds):
+    def distribution(values):
+        return {"mean": float(np.mean(values)), "std": float(np.std(values)), "min": int(np.min(values)),
+                "max": int(np.max(values)), **{f"p{p}": float(np.percentile(values, p)) for p in (10, 50, 90)}}
+
+    return {"games": len(scores), "pipes_passed": distribution(scores), "survival_frames": distribution(frames),
+            "truncated": int(truncated.sum()), "decisions_per_sec": decisions / seconds,
+            "frames_per_sec": float(frames.sum()) / seconds, "seconds": seconds}
+
+
+def main():
+    with open("hyperparameters.yml", "r") as parameters_file:
+        parameters = yaml.safe_load(parameters_file)
+
+    parser = argparse.ArgumentParser(description="Greedy evaluation of Flappy Bird DQN weights")
+    parser.add_argument("--weights", default=parameters["weights_file"], help=".weights.h5 or .tflite file")
+    parser.add_argument("--policy-precision", default="float32", choices=["float32", "int8"],
+                        help="int8 plays with the TensorFlow Lite model exported by quantize.py")
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--envs", type=int, default=256, help="games played at the same time")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--action-repeat", type=int, default=parameters["action_repeat"])
+    parser.add_argument("--max-frames", type=int, default=100000, help="frame limit per game")
+    parser.add_argument("--output", default=None, help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    policy = loadPolicy(args.weights, parameters["hidden_nodes"], args.policy_precision)
+    results = summarize(*evaluate(policy, args.games, args.envs, args.seed, args.action_repeat, args.max_frames))
+    results.update(weights=args.weights, policy_precision=args.policy_precision, seed=args.seed,
+                   action_repeat=args.action_repeat)
+
+    if args.output is not None:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import pygame, random
+from collections import deque
 from .flappybird_constants import *
 import os
 
@@ -16,56 +17,131 @@ pipe_green_path = os.path.join(current_dir,"assets", "sprites", "pipe-green.png"
 pipe_red_path = os.path.join(current_dir,"assets", "sprites", "pipe-red.png")
 base_path = os.path.join(current_dir,"assets", "sprites", "base.png")
 
-pygame.init()
-pygame.mixer.init()
-pygame.font.init()
-font = pygame.font.Font(font_path, 42)
-font2 = pygame.font.Font(font_path, 28)
+# Shared asset cache. Every image, mask, font and sound is loaded the first time it is needed and then shared by
+# all the sprites using it, so importing this module doesn't start pygame and nothing is decoded twice.
+images = {}
+masks = {}
+fonts = {}
+sounds = {}
+
+
+# Initialize the display on SDL's offscreen driver, putting SDL_VIDEODRIVER back afterwards so windows opened later
+# in the process use the normal driver
+def init_dummy_display():
+    driver = os.environ.get("SDL_VIDEODRIVER")
+    os.environ["SDL_VIDEODRIVER"] = "dummy"
+    try:
+        pygame.display.init()
+    finally:
+        if driver is None:
+            del os.environ["SDL_VIDEODRIVER"]
+        else:
+            os.environ["SDL_VIDEODRIVER"] = driver
+
+
+# returns the image at path, optionally scaled to size and flipped upside down
+def get_image(path, size=None, inverted=False):
+    key = (path, size, inverted)
+    if key not in images:
+        if inverted:
+            image = pygame.transform.flip(get_image(path, size), False, True)
+        else:
+            image = pygame.image.load(path).convert_alpha()
+            if size is not None:
+                image = pygame.transform.scale(image, size)
+        images[key] = image
+    return images[key]
+
+
+# returns the collision mask of get_image(path, size, inverted)
+def get_mask(path, size=None, inverted=False):
+    key = (path, size, inverted)
+    if key not in masks:
+        masks[key] = pygame.mask.from_surface(get_image(path, size, inverted))
+    return masks[key]
+
+
+def get_font(size):
+    if size not in fonts:
+        if not pygame.font.get_init():
+            pygame.font.init()
+        fonts[size] = pygame.font.Font(font_path, size)
+    return fonts[size]
+
+
+def get_sound(path):
+    if path not in sounds:
+        sounds[path] = pygame.mixer.Sound(path)
+    return sounds[path]
+
+
+# angles the bird can be drawn at. Bird.update() turns it by 4 degrees per frame down to -90 and bump() sets
+# it back to 30, so the angle is always an even number between -92 and 30.
+MIN_BIRD_ANGLE = -92
+MAX_BIRD_ANGLE = 30
+BIRD_ANGLE_STEP = 2
+
+# pre-rendered bird sprites and their collision masks, indexed by [flap frame][angle bucket]
+bird_atlas = None
+
+
+# Render the bird once for every flap frame and angle bucket, the same way Bird.update() used to draw it every
+# frame. Like the rest of the cache, it is built by the first Bird since convert_alpha() needs a video mode.
+def get_bird_atlas():
+    global bird_atlas
+    if bird_atlas is None:
+        bird_atlas = []
+        for path in (bird_upflap_path, bird_midflap_path, bird_downflap_path):
+            image = get_image(path)
+            frames = []
+            for angle in range(MIN_BIRD_ANGLE, MAX_BIRD_ANGLE + 1, BIRD_ANGLE_STEP):
+                rotated = pygame.transform.rotate(pygame.transform.rotate(image, 30), angle)
+                frames.append((rotated, pygame.mask.from_surface(rotated)))
+            bird_atlas.append(frames)
+    return bird_atlas
+
+
+# (image, mask) of the bird for a flap frame and angle
+def get_bird_frame(flap, angle):
+    angle = min(max(angle, MIN_BIRD_ANGLE), MAX_BIRD_ANGLE)
+    return get_bird_atlas()[flap][(angle - MIN_BIRD_ANGLE) // BIRD_ANGLE_STEP]
 
-wing_sound = pygame.mixer.Sound(wing_path)
-hit_sound = pygame.mixer.Sound(hit_path)
-point_sound = pygame.mixer.Sound(point_path)
 
 class Bird(pygame.sprite.Sprite):
 
     def __init__(self):
         super().__init__()
 
-        self.images =  [pygame.image.load(bird_upflap_path).convert_alpha(),
-                        pygame.image.load(bird_midflap_path).convert_alpha(),
-                        pygame.image.load(bird_downflap_path).convert_alpha()]
+        self.atlas = get_bird_atlas()
 
         self.speed = SPEED
 
         self.current_image = 0
-        self.image = self.images[0]
-        self.mask = pygame.mask.from_surface(self.image)
+        self.current_angle = 0
+        self._setImage()
 
-        self.rect = self.image.get_rect()
+        self.rect = pygame.Rect(0, 0, BIRD_WIDHT, BIRD_HEIGHT)
         self.rect[0] = SCREEN_WIDHT / 6
         self.rect[1] = SCREEN_HEIGHT / 2.5
 
-        self.current_angle = 0
+    # look up the sprite and collision mask for the current flap frame and angle
+    def _setImage(self):
+        self.image, self.mask = get_bird_frame(self.current_image, self.current_angle)
 
     def update(self):
         self.current_image = (self.current_image + 1) % 3
-        self.image = self.images[self.current_image]
-        self.image = pygame.transform.rotate(self.image, 30)
         self.speed += GRAVITY
         if self.speed > MAXSPEED:
             self.speed = MAXSPEED
         self.current_angle = (self.current_angle - 4) if (self.current_angle > -90) else -90
-
-        self.image = pygame.transform.rotate(self.image, self.current_angle)
-        # self.rect = self.image.get_rect(center=self.rect.center)
+        self._setImage()
 
         #UPDATE HEIGHT
         self.rect[1] += self.speed
 
     def bump(self):
         self.current_angle = 30
-        self.image = pygame.transform.rotate(self.image, self.current_angle)
-        # self.rect = self.image.get_rect(center=self.rect.center)
+        self._setImage()
         self.speed = -SPEED
 
         # make sure bird doesn't fly above the boundaries of the screen
@@ -77,8 +153,7 @@ class Bird(pygame.sprite.Sprite):
         self.rect[1] = SCREEN_HEIGHT / 2.5
         self.current_image = (self.current_image + 1) % 3
         self.current_angle = 0
-        self.image = self.images[self.current_image]
-        self.image = pygame.transform.rotate(self.image, self.current_angle)
+        self._setImage()
 
 
 
@@ -87,24 +162,24 @@ class Pipe(pygame.sprite.Sprite):
     def __init__(self, inverted, xpos, ysize, has_portal=False):
         super().__init__()
 
+        self.rect = pygame.Rect(0, 0, PIPE_WIDHT, PIPE_HEIGHT)
+        self.reset(inverted, xpos, ysize, has_portal)
+
+    # move the pipe and switch between the red and green variant by swapping the cached images
+    def reset(self, inverted, xpos, ysize, has_portal=False):
         pipe_path = pipe_red_path if has_portal else pipe_green_path
-        self.image = pygame.image.load(pipe_path).convert_alpha()
-        self.image = pygame.transform.scale(self.image, (PIPE_WIDHT, PIPE_HEIGHT))
+        self.image = get_image(pipe_path, (PIPE_WIDHT, PIPE_HEIGHT), inverted)
+        self.mask = get_mask(pipe_path, (PIPE_WIDHT, PIPE_HEIGHT), inverted)
         self.has_portal = has_portal
 
-        self.rect = self.image.get_rect()
         self.rect[0] = xpos
 
         if inverted:
-            self.image = pygame.transform.flip(self.image, False, True)
             self.rect[1] = - (self.rect[3] - ysize)
         else:
             self.rect[1] = SCREEN_HEIGHT - ysize
 
 
-        self.mask = pygame.mask.from_surface(self.image)
-
-
     def update(self):
         self.rect[0] -= GAME_SPEED
 
@@ -159,8 +234,8 @@ class Reward(pygame.sprite.Sprite):
     def update(self):
         self.rect[0] -= GAME_SPEED
 
-    def reset(self):
-        self.rect[0] = SCREEN_WIDHT * 2
+    def reset(self, xpos=SCREEN_WIDHT * 2):
+        self.rect[0] = xpos
 
 
 class Portal(pygame.sprite.Sprite):
@@ -172,22 +247,114 @@ class Portal(pygame.sprite.Sprite):
         pygame.draw.ellipse(self.image, (0, 0, 0), (15, 20, 10, 20))
         
         self.rect = self.image.get_rect()
-        self.rect[0] = xpos
-        self.rect[1] = ypos
+        self.reset(xpos, ypos)
         
         self.mask = pygame.mask.from_surface(self.image)
+
+    def reset(self, xpos, ypos):
+        self.rect[0] = xpos
+        self.rect[1] = ypos
     
     def update(self):
         self.rect[0] -= GAME_SPEED
 
 
+# A bottom pipe, its inverted top pipe, the reward line between them and a portal in the gap, used only when
+# has_portal is set. FlappyBird keeps a fixed pool of pairs and resets them in place when they scroll off screen.
+class PipePair():
+    def __init__(self):
+        self.pipe = Pipe(False, 0, 0)
+        self.pipe_inverted = Pipe(True, 0, 0)
+        self.reward = Reward(0)
+        self.portal = Portal(0, 0)
+        self.has_portal = False
+
+    # move the pair to xpos with a bottom pipe of the given size
+    def reset(self, xpos, size, has_portal):
+        self.pipe.reset(False, xpos, size, has_portal)
+        self.pipe_inverted.reset(True, xpos, SCREEN_HEIGHT - size - PIPE_GAP, has_portal)
+        self.reward.reset(xpos + PIPE_WIDHT/2)
+        self.has_portal = has_portal
+        if has_portal:
+            self.portal.reset(xpos + PIPE_WIDHT//2 - 20, SCREEN_HEIGHT - size - PIPE_GAP//2 - 30)
+
+    # left edge of the pipes
+    @property
+    def x(self):
+        return self.pipe.rect[0]
+
+    # top and bottom of the gap between the pipes
+    @property
+    def gap_top(self):
+        return self.pipe_inverted.rect.bottom
+
+    @property
+    def gap_bottom(self):
+        return self.pipe.rect[1]
+
+    # returns True if rect overlaps the pipes' columns outside of the gap
+    def hits_pipes(self, rect):
+        return (self.x < rect.right and self.x + PIPE_WIDHT > rect.left and
+                (rect.top < self.gap_top or rect.bottom > self.gap_bottom))
+
+    # the reward is taken once it has been removed from its groups, and so is the portal
+    def hits_reward(self, rect):
+        return self.reward.alive() and self.reward.rect.colliderect(rect)
+
+    def hits_portal(self, rect):
+        if not (self.has_portal and self.portal.alive()):
+            return False
+        hitbox = pygame.Rect(self.portal.rect[0] + PORTAL_HITBOX[0], self.portal.rect[1] + PORTAL_HITBOX[1],
+                             PORTAL_HITBOX[2], PORTAL_HITBOX[3])
+        return hitbox.colliderect(rect)
+
+
+# Queue of the pooled pipe pairs, ordered from left to right. Pairs are much further apart than the bird is wide
+# and the bird never moves horizontally, so only the first two pairs can ever touch it and every query is O(1).
+class PipeQueue():
+    def __init__(self, pairs):
+        self.pairs = deque(pairs)
+
+    def __iter__(self):
+        return iter(self.pairs)
+
+    def first(self):
+        return self.pairs[0]
+
+    # move the first pair to the back of the queue and return it
+    def recycle(self):
+        self.pairs.rotate(-1)
+        return self.pairs[-1]
+
+    # the nearest pair whose pipes aren't entirely behind x
+    def nearest_ahead(self, x):
+        if self.pairs[0].x + PIPE_WIDHT < x:
+            return self.pairs[1]
+        return self.pairs[0]
+
+    def hits_pipes(self, rect):
+        return self.pairs[0].hits_pipes(rect) or self.pairs[1].hits_pipes(rect)
+
+    # returns the pair whose reward rect overlaps, or None
+    def reward_hit(self, rect):
+        for pair in (self.pairs[0], self.pairs[1]):
+            if pair.hits_reward(rect):
+                return pair
+        return None
+
+    # returns the pair whose portal rect overlaps, or None
+    def portal_hit(self, rect):
+        for pair in (self.pairs[0], self.pairs[1]):
+            if pair.hits_portal(rect):
+                return pair
+        return None
+
+
 class Ground(pygame.sprite.Sprite):
     def __init__(self, xpos):
         super().__init__()
-        self.image = pygame.image.load(base_path).convert_alpha()
-        self.image = pygame.transform.scale(self.image, (GROUND_WIDHT, GROUND_HEIGHT))
-
-        self.mask = pygame.mask.from_surface(self.image)
+        self.image = get_image(base_path, (GROUND_WIDHT, GROUND_HEIGHT))
+        self.mask = get_mask(base_path, (GROUND_WIDHT, GROUND_HEIGHT))
 
         self.rect = self.image.get_rect()
         self.rect[0] = xpos
@@ -202,9 +369,9 @@ def is_off_screen(sprite):
 
 
 # will be implemented in flappybird.py
-def get_random_pipes(xpos):
-    size = random.randint(100, 350)
-    has_portal = random.random() < 0.3  # 30% chance for portal
+def get_random_pipes(xpos, rng=random):
+    size = rng.randint(100, 350)
+    has_portal = rng.random() < 0.3  # 30% chance for portal
 
     pipe = Pipe(False, xpos, size, has_portal)
     pipe_inverted = Pipe(True, xpos, SCREEN_HEIGHT - size - PIPE_GAP, has_portal)
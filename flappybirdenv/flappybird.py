@@ -2,30 +2,57 @@ import pygame
 from pygame.locals import *
 from .AllComponents import *
 from .flappybird_constants import *
+from collections import namedtuple
 
 
+# Full state of a game, returned by FlappyBird.snapshot() and put back by FlappyBird.restore().
+# bird: (x, y, speed, angle, flap frame), pipes: one (x, size, has_portal, reward_taken, portal_taken) per pair
+# from left to right, grounds: x of each ground, rng_state: state of the game's random generator.
+GameSnapshot = namedtuple("GameSnapshot", ["bird", "pipes", "grounds", "background", "score", "rng_state"])
+
 
 class FlappyBird():
-    def __init__(self):
+    def __init__(self, headless=False, exact_collision=False, seed=None):
+        # in headless mode the game runs unthrottled, without drawing, fonts or sounds
+        self.headless = headless
+        # collisions are analytic rectangle tests, unless exact pixel mask collisions are asked for
+        self.exact_collision = exact_collision
+        # every random pipe comes from the game's own generator, so a seed makes the game reproducible
+        self.rng = random.Random(seed)
+
         #initialize pygame resources
-        pygame.init()
-        pygame.mixer.init()
-        pygame.font.init()
+        if headless:
+            # Sprites still need a video mode for convert_alpha(). Use the one already open if there is one,
+            # otherwise open one on SDL's offscreen driver. Fonts and sounds are never initialized.
+            if not pygame.display.get_init():
+                init_dummy_display()
+            self.screen = pygame.display.get_surface()
+            if self.screen is None:
+                self.screen = pygame.display.set_mode((SCREEN_WIDHT, SCREEN_HEIGHT), pygame.HIDDEN)
+        else:
+            # a display opened offscreen by headless games is replaced by a window
+            if pygame.display.get_init() and pygame.display.get_driver() == "dummy" and \
+                    os.environ.get("SDL_VIDEODRIVER") != "dummy":
+                pygame.display.quit()
+            pygame.init()
+            pygame.mixer.init()
+            pygame.font.init()
         current_dir = os.path.dirname(os.path.abspath(__file__))
 
-        # initialize game window 
-        self.screen = pygame.display.set_mode((SCREEN_WIDHT, SCREEN_HEIGHT))
-        pygame.display.set_caption('Flappy Bird')
-        pygame.mixer.set_num_channels(10)
+        if not headless:
+            # initialize game window
+            self.screen = pygame.display.set_mode((SCREEN_WIDHT, SCREEN_HEIGHT))
+            pygame.display.set_caption('Flappy Bird')
+            pygame.mixer.set_num_channels(10)
 
-        # constant score and epoch positions
-        self.score_pos = (SCREEN_WIDHT // 2 - font.get_height() // 2, SCREEN_HEIGHT//20)
-        self.epoch_pos = (SCREEN_WIDHT // 18 - font.get_height() // 2, SCREEN_HEIGHT//20)
+            # constant score and epoch positions
+            self.score_pos = (SCREEN_WIDHT // 2 - get_font(42).get_height() // 2, SCREEN_HEIGHT//20)
+            self.epoch_pos = (SCREEN_WIDHT // 18 - get_font(42).get_height() // 2, SCREEN_HEIGHT//20)
 
         # load backgrounds
         self.backgrounds = {
-            'day': pygame.transform.scale(pygame.image.load(os.path.join(current_dir, "assets", "sprites","background-day.png")), (SCREEN_WIDHT, SCREEN_HEIGHT)),
-            'night': pygame.transform.scale(pygame.image.load(os.path.join(current_dir, "assets", "sprites","background-night.png")), (SCREEN_WIDHT, SCREEN_HEIGHT))
+            'day': get_image(os.path.join(current_dir, "assets", "sprites","background-day.png"), (SCREEN_WIDHT, SCREEN_HEIGHT)),
+            'night': get_image(os.path.join(current_dir, "assets", "sprites","background-night.png"), (SCREEN_WIDHT, SCREEN_HEIGHT))
         }
         self.current_bg = 'day'
         self.BACKGROUND = self.backgrounds[self.current_bg]
@@ -49,7 +76,8 @@ class FlappyBird():
             ground = Ground(GROUND_WIDHT * i)
             self.ground_group.add(ground) 
 
-        # initialize pipes and reward groups
+        # initialize the pool of pipe pairs, ordered from left to right, then the pipes and reward groups
+        self.pipes = PipeQueue(PipePair() for _ in range(3))
         self._spawnFirstPipes()
 
         # start score at 0
@@ -59,37 +87,40 @@ class FlappyBird():
 
     # Spawn the first 3 pipes and rewards at predefined locations
     def _spawnFirstPipes(self):
-        for i in range (3):  # spawn 3 pipes
+        for i, pair in enumerate(self.pipes):  # spawn 3 pipes
             pos =  250 * i + 400  # spawn locations
-            pipesAndReward = self._getRandomPipesAndReward(pos)  # generate pipes at random heights
-            self.pipe_group.add(pipesAndReward[0])
-            self.pipe_group.add(pipesAndReward[1])
-            self.reward_group.add(pipesAndReward[2])
-            if pipesAndReward[3]:  # portal exists
-                self.portal_group.add(pipesAndReward[3])
+            self._randomizePipePair(pair, pos)  # move pipes to random heights
+            self._addPipePair(pair)
 
 
-    # Generate random pipe and reward at a predefined position
-    def _getRandomPipesAndReward(self, xpos):
+    # Move a pooled pipe pair and its reward to a predefined position, with a random height
+    def _randomizePipePair(self, pair, xpos):
         # chooses a random pipe height 
-        size = random.randint(100, 350)
-        has_portal = random.randint(1, 10) <= 3  # 30% chance
-
-        # Create pipes and a reward
-        pipe = Pipe(False, xpos, size, has_portal)
-        pipe_inverted = Pipe(True, xpos, SCREEN_HEIGHT - size - PIPE_GAP, has_portal)
-        reward = Reward(xpos + PIPE_WIDHT/2)
-        
-        portal = None
-        if has_portal:
-            portal_y = SCREEN_HEIGHT - size - PIPE_GAP//2 - 30
-            portal = Portal(xpos + PIPE_WIDHT//2 - 20, portal_y)
-
-        return pipe, pipe_inverted, reward, portal
+        size = self.rng.randint(100, 350)
+        has_portal = self.rng.randint(1, 10) <= 3  # 30% chance
+
+        pair.reset(xpos, size, has_portal)
+
+    # add the sprites of a pipe pair to their groups
+    def _addPipePair(self, pair):
+        self.pipe_group.add(pair.pipe, pair.pipe_inverted)
+        self.reward_group.add(pair.reward)
+        if pair.has_portal:  # portal exists
+            self.portal_group.add(pair.portal)
+
+    # remove the sprites of a pipe pair from their groups, including a reward or portal that wasn't taken
+    def _removePipePair(self, pair):
+        self.pipe_group.remove(pair.pipe, pair.pipe_inverted)
+        self.reward_group.remove(pair.reward)
+        self.portal_group.remove(pair.portal)
     
 
-    # resets the game to the starting positions for the necessary objects
-    def resetGame(self):
+    # resets the game to the starting positions for the necessary objects, reseeding the random generator if a
+    # seed is given
+    def resetGame(self, seed=None):
+        if seed is not None:
+            self.rng.seed(seed)
+
         # empty groups
         self.pipe_group.empty()
         self.reward_group.empty()
@@ -107,19 +138,53 @@ class FlappyBird():
         self.score = 0
 
 
+    # returns the full state of the game, which restore() can put back later
+    def snapshot(self):
+        bird = (self.bird.rect[0], self.bird.rect[1], self.bird.speed, self.bird.current_angle, self.bird.current_image)
+        pipes = tuple((pair.x, SCREEN_HEIGHT - pair.gap_bottom, pair.has_portal,
+                       not pair.reward.alive(), pair.has_portal and not pair.portal.alive())
+                      for pair in self.pipes)
+        grounds = tuple(ground.rect[0] for ground in self.ground_group.sprites())
+
+        return GameSnapshot(bird, pipes, grounds, self.current_bg, self.score, self.rng.getstate())
+
+    # put the game back in the state of a snapshot, after which it plays exactly as it did from there
+    def restore(self, snapshot):
+        self.pipe_group.empty()
+        self.reward_group.empty()
+        self.portal_group.empty()
+
+        for pair, (x, size, has_portal, reward_taken, portal_taken) in zip(self.pipes, snapshot.pipes):
+            pair.reset(x, size, has_portal)
+            self._addPipePair(pair)
+            if reward_taken:
+                pair.reward.kill()
+            if portal_taken:
+                pair.portal.kill()
+
+        grounds = self.ground_group.sprites()
+        self.ground_group.empty()
+        for ground, x in zip(grounds, snapshot.grounds):
+            ground.rect[0] = x
+            self.ground_group.add(ground)
+
+        self.bird.rect[0], self.bird.rect[1], self.bird.speed, self.bird.current_angle, self.bird.current_image = snapshot.bird
+        self.bird._setImage()
+
+        self.current_bg = snapshot.background
+        self.BACKGROUND = self.backgrounds[self.current_bg]
+        self.score = snapshot.score
+        self.rng.setstate(snapshot.rng_state)
+
     # returns the current game state
     def getGameState(self):
         state_params = []
 
-        # choose the nearest pipes by checking their distance from the bird
-        chosenpipeindex = 0
-        nextpipe_x = self.pipe_group.sprites()[chosenpipeindex].rect[0] + PIPE_WIDHT
-        if (nextpipe_x < self.bird.rect[0]):
-            chosenpipeindex = 2  # if the next pipe is to the left of the bird, choose the right pipe
+        # choose the nearest pipes that the bird hasn't passed yet
+        nextpipe = self.pipes.nearest_ahead(self.bird.rect[0])
 
         # get the nearest pipes' vertical positions
-        nextpipe_x = self.pipe_group.sprites()[chosenpipeindex].rect[0] - self.bird.rect[0]
-        nextpipe_bottom_y = self.pipe_group.sprites()[chosenpipeindex].rect[1]
+        nextpipe_bottom_y = nextpipe.gap_bottom
         nextpipe_top_y = nextpipe_bottom_y - PIPE_GAP
 
         # gap middle vertical position
@@ -147,15 +212,13 @@ class FlappyBird():
     # takes one action and advances the game by 1 step (1 frame)
     def step(self, action=None, epoch=-1):
         # tick pygame clock and reset variables 
-        self.clock.tick_busy_loop(30)
+        if not self.headless:
+            self.clock.tick_busy_loop(30)
         gameOver = gotReward = False
 
-        # render epoch if necessary and the score
-        display_score = font.render(str(self.score), True, (255, 255, 255))
-        display_epoch = font2.render(f"epoch: {epoch}", True, (255, 255, 255))
-
-        # handle user events
-        self._handleEvents()
+        if not self.headless:
+            # handle user events
+            self._handleEvents()
 
         # take action
         if action == 1:
@@ -165,27 +228,21 @@ class FlappyBird():
             raise Exception("no action")
 
 
-        # check if the ground sprite is off screen and update it
-        if is_off_screen(self.ground_group.sprites()[0]):
-            self.ground_group.remove(self.ground_group.sprites()[0])
+        # check if the ground sprite is off screen and move it behind the other one
+        ground = self.ground_group.sprites()[0]
+        if is_off_screen(ground):
+            self.ground_group.remove(ground)
+            ground.rect[0] = GROUND_WIDHT - 20
+            self.ground_group.add(ground)
 
-            new_ground = Ground(GROUND_WIDHT - 20)
-            self.ground_group.add(new_ground)
+        # Recycle the first pipe pair as a new one if it is off screen
+        if is_off_screen(self.pipes.first().pipe):
+            pair = self.pipes.recycle()
+            self._removePipePair(pair)
 
-        # Spawn new pipes if the first pipe is off screen
-        if is_off_screen(self.pipe_group.sprites()[0]):
-            self.pipe_group.remove(self.pipe_group.sprites()[0])
-            self.pipe_group.remove(self.pipe_group.sprites()[0])
-            if self.reward_group.sprites():
-                self.reward_group.remove(self.reward_group.sprites()[0])
+            self._randomizePipePair(pair, DEFAULT_PIPE_SPAWN_POINT)
 
-            pipesAndReward = self._getRandomPipesAndReward(DEFAULT_PIPE_SPAWN_POINT)
-
-            self.pipe_group.add(pipesAndReward[0])
-            self.pipe_group.add(pipesAndReward[1])
-            self.reward_group.add(pipesAndReward[2])
-            if pipesAndReward[3]:
-                self.portal_group.add(pipesAndReward[3])
+            self._addPipePair(pair)
 
         # Call the update() method for each of the sprite group objects, which updates their positions
         self.bird_group.update()
@@ -194,6 +251,69 @@ class FlappyBird():
         self.reward_group.update()
         self.portal_group.update()
 
+        # Check for collisions between the bird and any of the ground, pipes, or top boundary, and whether it has
+        # captured a reward or entered a portal
+        if self.exact_collision:
+            gameOver, gotReward, portal_reward = self._checkCollisionsExact()
+        else:
+            gameOver, gotReward, portal_reward = self._checkCollisions()
+
+        if gotReward:
+            # play point sound
+            if not self.headless:
+                pygame.mixer.find_channel().play(get_sound(point_path))
+
+            # increment score
+            self.score += 1
+
+        if portal_reward:
+            # Switch background
+            self.current_bg = 'night' if self.current_bg == 'day' else 'day'
+            self.BACKGROUND = self.backgrounds[self.current_bg]
+
+        if not self.headless:
+            self._draw(epoch)
+            
+        return gameOver, gotReward, portal_reward
+
+    # Analytic collisions between the bird's rectangle and the two pipe pairs next to it.
+    # Returns (gameOver, gotReward, portal_reward).
+    def _checkCollisions(self):
+        rect = self.bird.rect
+        gameOver = (rect.bottom > SCREEN_HEIGHT - GROUND_HEIGHT or (rect.top <= 0 < rect.bottom) or
+                    self.pipes.hits_pipes(rect))
+
+        # remove the captured reward or portal from the game
+        pair = self.pipes.reward_hit(rect)
+        if pair is not None:
+            pair.reward.kill()
+        gotReward = pair is not None
+
+        pair = self.pipes.portal_hit(rect)
+        if pair is not None:
+            pair.portal.kill()
+        portal_reward = pair is not None
+
+        return gameOver, gotReward, portal_reward
+
+    # Pixel mask collisions between the bird's sprite and every sprite group. Returns (gameOver, gotReward, portal_reward).
+    def _checkCollisionsExact(self):
+        gameOver = bool(pygame.sprite.groupcollide(self.bird_group, self.ground_group, False, False, pygame.sprite.collide_mask) or
+                        pygame.sprite.groupcollide(self.bird_group, self.pipe_group, False, False, pygame.sprite.collide_mask) or
+                        pygame.sprite.collide_mask(self.bird, self.top_boundary))
+
+        # remove the captured reward or portal from the game
+        gotReward = bool(pygame.sprite.spritecollide(self.bird, self.reward_group, True, pygame.sprite.collide_mask))
+        portal_reward = bool(pygame.sprite.groupcollide(self.bird_group, self.portal_group, False, True, pygame.sprite.collide_mask))
+
+        return gameOver, gotReward, portal_reward
+
+    # draw the current frame on the screen
+    def _draw(self, epoch):
+        # render epoch if necessary and the score
+        display_score = get_font(42).render(str(self.score), True, (255, 255, 255))
+        display_epoch = get_font(28).render(f"epoch: {epoch}", True, (255, 255, 255))
+
         # draw the background
         self.screen.blit(self.BACKGROUND, (0, 0))
 
@@ -209,36 +329,5 @@ class FlappyBird():
         self.screen.blit(display_epoch, self.epoch_pos)
         self.screen.blit(self.top_boundary.surf, (0, -4))
 
-        # Check for collisions between the bird and any of the ground, pipes, or top boundary
-        if (pygame.sprite.groupcollide(self.bird_group, self.ground_group, False, False, pygame.sprite.collide_mask) or
-                pygame.sprite.groupcollide(self.bird_group, self.pipe_group, False, False, pygame.sprite.collide_mask) or
-                pygame.sprite.collide_mask(self.bird, self.top_boundary)):
-            # pygame.mixer.find_channel().play(hit_sound)
-            gameOver = True
-
-        # Check if the bird has captured a reward
-        if (pygame.sprite.groupcollide(self.bird_group, self.reward_group, False, False, pygame.sprite.collide_mask)):
-            # remove the captured reward object from game
-            self.reward_group.remove(self.reward_group.sprites()[0])
-
-            # play point sound
-            pygame.mixer.find_channel().play(point_sound)
-
-            # increment score
-            self.score += 1
-
-            # set gotReward to true
-            gotReward = True
-        
-        # Check if bird enters portal
-        portal_reward = False
-        if (pygame.sprite.groupcollide(self.bird_group, self.portal_group, False, True, pygame.sprite.collide_mask)):
-            # Switch background
-            self.current_bg = 'night' if self.current_bg == 'day' else 'day'
-            self.BACKGROUND = self.backgrounds[self.current_bg]
-            portal_reward = True
-
         # update entire game display
-        pygame.display.update()
-            
-        return gameOver, gotReward, portal_reward
\ No newline at end of file
+        pygame.display.update()
\ No newline at end of file
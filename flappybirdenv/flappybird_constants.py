@@ -13,3 +13,10 @@ PIPE_GAP = 130
 DEFAULT_PIPE_SPAWN_POINT = SCREEN_WIDHT +  250
 
 SCORE = 0
+
+BIRD_WIDHT = 34
+BIRD_HEIGHT = 24
+
+REWARD_WIDHT = 3
+# visible part of a portal sprite: x, y, width, height
+PORTAL_HITBOX = (5, 10, 30, 40)
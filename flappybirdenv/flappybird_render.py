@@ -0,0 +1,184 @@
+import pygame
+import json
+import os
+import queue
+import threading
+import numpy as np
+from .AllComponents import *
+from .flappybird_constants import *
+
+
+# Offscreen rendering of games, decoupled from the simulation. FrameRenderer draws a frame from a GameSnapshot
+# (FlappyBird.snapshot()) onto its own pygame.Surface, without touching the game or the display, and
+# FrameCapture hands the snapshots of the captured games to a background thread through a bounded queue. The
+# thread renders the frames and writes them as PNG sequences or raw RGB files, so the game keeps running
+# headless and only pays for a snapshot per captured frame. Works under SDL's dummy video driver.
+
+CAPTURE_FORMATS = ("png", "rgb")
+
+
+# open a hidden 1x1 video mode, falling back to SDL's dummy driver without changing the environment for later
+def openHiddenMode():
+    try:
+        pygame.display.init()
+        pygame.display.set_mode((1, 1), pygame.HIDDEN)
+    except pygame.error:
+        pygame.display.quit()
+        init_dummy_display()
+        pygame.display.set_mode((1, 1))
+
+
+# Draws snapshots the way FlappyBird._draw() draws the game
+class FrameRenderer():
+    def __init__(self):
+        # The sprites need a video mode for convert_alpha(). Create the game first to use its window or offscreen
+        # mode, otherwise a hidden one is opened, on SDL's offscreen driver only if there is no display at all.
+        if pygame.display.get_surface() is None:
+            openHiddenMode()
+
+        self.surface = pygame.Surface((SCREEN_WIDHT, SCREEN_HEIGHT))
+
+        # load everything up front, so the cache isn't filled from another thread
+        sprites = os.path.join(current_dir, "assets", "sprites")
+        self.backgrounds = {
+            'day': get_image(os.path.join(sprites, "background-day.png"), (SCREEN_WIDHT, SCREEN_HEIGHT)),
+            'night': get_image(os.path.join(sprites, "background-night.png"), (SCREEN_WIDHT, SCREEN_HEIGHT))
+        }
+        self.pipes = {has_portal: (get_image(path, (PIPE_WIDHT, PIPE_HEIGHT)),
+                                   get_image(path, (PIPE_WIDHT, PIPE_HEIGHT), True))
+                      for has_portal, path in ((False, pipe_green_path), (True, pipe_red_path))}
+        self.ground = get_image(base_path, (GROUND_WIDHT, GROUND_HEIGHT))
+        self.portal = Portal(0, 0).image
+        get_bird_atlas()
+
+        self.score_font = get_font(42)
+        self.epoch_font = get_font(28)
+        self.score_pos = (SCREEN_WIDHT // 2 - self.score_font.get_height() // 2, SCREEN_HEIGHT//20)
+        self.epoch_pos = (SCREEN_WIDHT // 18 - self.score_font.get_height() // 2, SCREEN_HEIGHT//20)
+
+    # draw the snapshot, returns the surface, which is reused by the next call
+    def render(self, snapshot, epoch=None):
+        surface = self.surface
+        surface.blit(self.backgrounds[snapshot.background], (0, 0))
+
+        x, y, _, angle, flap = snapshot.bird
+        surface.blit(get_bird_frame(flap, angle)[0], (x, y))
+
+        for x, size, has_portal, _, _ in snapshot.pipes:
+            pipe, pipe_inverted = self.pipes[has_portal]
+            surface.blit(pipe, (x, SCREEN_HEIGHT - size))
+            surface.blit(pipe_inverted, (x, SCREEN_HEIGHT - size - PIPE_GAP - PIPE_HEIGHT))
+
+        for x in snapshot.grounds:
+            surface.blit(self.ground, (x, SCREEN_HEIGHT - GROUND_HEIGHT))
+
+        for x, size, has_portal, _, portal_taken in snapshot.pipes:
+            if has_portal and not portal_taken:
+                surface.blit(self.portal, (x + PIPE_WIDHT//2 - 20, SCREEN_HEIGHT - size - PIPE_GAP//2 - 30))
+
+        surface.blit(self.score_font.render(str(snapshot.score), True, (255, 255, 255)), self.score_pos)
+        if epoch is not None:
+            surface.blit(self.epoch_font.render(f"epoch: {epoch}", True, (255, 255, 255)), self.epoch_pos)
+        return surface
+
+
+# Captures games to directory, as directory/episode{N}/frame{i}.png or as directory/episode{N}.rgb, the raw
+# frames one after the other (height x width x 3 bytes each) with their shape in episode{N}.json. Games are
+# captured from beginEpisode() to endEpisode(), frame() queues a snapshot of the game. When the queue is full,
+# frame() waits for the writer, so every frame of a captured game is kept.
+class FrameCapture():
+    def __init__(self, directory, format="png", queueSize=256, showEpoch=True):
+        if format not in CAPTURE_FORMATS:
+            raise ValueError(f"unknown capture format: {format}")
+        self.directory = directory
+        self.format = format
+        self.showEpoch = showEpoch
+        self.episode = None
+        self.error = None
+        os.makedirs(directory, exist_ok=True)
+
+        self.renderer = FrameRenderer()
+        self.queue = queue.Queue(maxsize=queueSize)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    # start capturing a game, episode names its files
+    def beginEpisode(self, episode):
+        self.episode = episode
+        self._put(("begin", episode))
+
+    # queue the current frame of game
+    def frame(self, game):
+        self._put(("frame", game.snapshot()._replace(rng_state=None)))
+
+    def endEpisode(self):
+        if self.episode is not None:
+            self._put(("end", None))
+            self.episode = None
+
+    def _put(self, item):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+        self.queue.put(item)
+
+    def _run(self):
+        episode = file = None
+        frames = 0
+        while True:
+            kind, value = self.queue.get()
+            try:
+                if self.error is not None:
+                    continue
+                if kind == "begin":
+                    episode, frames = value, 0
+                    if self.format == "png":
+                        os.makedirs(os.path.join(self.directory, f"episode{episode}"), exist_ok=True)
+                    else:
+                        file = open(os.path.join(self.directory, f"episode{episode}.rgb"), "wb")
+                elif kind == "frame":
+                    surface = self.renderer.render(value, episode if self.showEpoch else None)
+                    if self.format == "png":
+                        pygame.image.save(surface, os.path.join(self.directory, f"episode{episode}",
+                                                                f"frame{frames:05d}.png"))
+                    else:
+                        file.write(pygame.image.tobytes(surface, "RGB"))
+                    frames += 1
+                elif kind == "end":
+                    if file is not None:
+                        file.close()
+                        file = None
+                        with open(os.path.join(self.directory, f"episode{episode}.json"), "w") as f:
+                            json.dump({"frames": frames, "height": SCREEN_HEIGHT, "width": SCREEN_WIDHT}, f)
+                elif kind == "stop":
+                    return
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    # wait until every queued frame is written, raising the writer's error if it failed
+    def wait(self):
+        self.queue.join()
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    # finish the current game and stop the writer
+    def close(self):
+        if self.thread is None:
+            return
+        self.endEpisode()
+        self.queue.put(("stop", None))
+        self.thread.join()
+        self.thread = None
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+
+# read the frames of a raw RGB capture, as a (frames, height, width, 3) uint8 array
+def loadRGB(path):
+    with open(path[:-len(".rgb")] + ".json", "r") as f:
+        shape = json.load(f)
+    return np.fromfile(path, dtype=np.uint8).reshape(shape["frames"], shape["height"], shape["width"], 3)
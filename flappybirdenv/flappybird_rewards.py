@@ -0,0 +1,16 @@
+# rewards given to the agent for the outcome of each frame
+PIPE_REWARD = 10.      # Higher reward for passing pipes
+PORTAL_REWARD = 5.     # Reward for entering portals
+DEATH_REWARD = -10.    # Higher penalty for dying
+ALIVE_REWARD = 0.1     # Small reward for staying alive
+
+
+# returns the reward for a single frame given the flags returned by FlappyBird.step()
+def getReward(gameOver, gotReward, portal_reward):
+    if gotReward:
+        return PIPE_REWARD
+    elif portal_reward:
+        return PORTAL_REWARD
+    elif gameOver:
+        return DEATH_REWARD
+    return ALIVE_REWARD
@@ -0,0 +1,153 @@
+import numpy as np
+from .flappybird_constants import *
+from .flappybird_rewards import *
+
+# number of pipe pairs alive in each game, same as FlappyBird._spawnFirstPipes()
+NUM_PIPES = 3
+PORTAL_CHANCE = 0.3
+
+# the bird never moves horizontally
+BIRD_X = int(SCREEN_WIDHT / 6)
+BIRD_START_Y = int(SCREEN_HEIGHT / 2.5)
+
+# offsets of the reward line and the visible part of the portal relative to the pipe's x position
+REWARD_OFFSET = int(PIPE_WIDHT / 2)
+PORTAL_OFFSET_X = PIPE_WIDHT // 2 - 20 + PORTAL_HITBOX[0]
+PORTAL_WIDHT = PORTAL_HITBOX[2]
+PORTAL_OFFSET_Y = - PIPE_GAP // 2 - 30 + PORTAL_HITBOX[1]
+PORTAL_HEIGHT = PORTAL_HITBOX[3]
+
+
+# N flappy bird games stepped in lockstep, stored in NumPy arrays. The physics follow Bird, Pipe, Reward
+# and Portal in AllComponents.py, but collisions are analytic rectangle tests instead of pixel masks, so
+# no pygame sprites are needed. Games that end are reset automatically at the end of step().
+class VectorFlappyBird():
+
+    def __init__(self, numEnvs, seed=None):
+        self.numEnvs = numEnvs
+        self.rng = np.random.default_rng(seed)
+
+        # bird state
+        self.birdY = np.zeros(numEnvs, dtype=np.float64)
+        self.birdSpeed = np.zeros(numEnvs, dtype=np.float64)
+
+        # pipe pairs, sorted from left to right. The size is the height of the bottom pipe.
+        self.pipeX = np.zeros((numEnvs, NUM_PIPES), dtype=np.int64)
+        self.pipeSize = np.zeros((numEnvs, NUM_PIPES), dtype=np.int64)
+        self.hasPortal = np.zeros((numEnvs, NUM_PIPES), dtype=bool)
+        self.rewardTaken = np.zeros((numEnvs, NUM_PIPES), dtype=bool)
+        self.portalTaken = np.zeros((numEnvs, NUM_PIPES), dtype=bool)
+
+        # per game statistics, and the statistics of the games that ended during the last step
+        self.scores = np.zeros(numEnvs, dtype=np.int64)
+        self.frames = np.zeros(numEnvs, dtype=np.int64)
+        self.finishedScores = np.zeros(numEnvs, dtype=np.int64)
+        self.finishedFrames = np.zeros(numEnvs, dtype=np.int64)
+
+        self._rows = np.arange(numEnvs)
+        self.reset()
+
+    # fill the selected pipe slots with new random pipes
+    def _randomizePipes(self, rows, cols):
+        self.pipeSize[rows, cols] = self.rng.integers(100, 351, size=len(rows))
+        self.hasPortal[rows, cols] = self.rng.random(len(rows)) < PORTAL_CHANCE
+        self.rewardTaken[rows, cols] = False
+        self.portalTaken[rows, cols] = False
+
+    # reset the games selected by mask (all games if mask is None) and return the states of all games
+    def reset(self, mask=None):
+        rows = self._rows if mask is None else np.flatnonzero(mask)
+        if len(rows):
+            self.birdY[rows] = BIRD_START_Y
+            self.birdSpeed[rows] = SPEED
+            self.scores[rows] = 0
+            self.frames[rows] = 0
+
+            # spawn the first pipes at the same locations as FlappyBird._spawnFirstPipes()
+            for i in range(NUM_PIPES):
+                self.pipeX[rows, i] = 250 * i + 400
+                self._randomizePipes(rows, np.full(len(rows), i))
+
+        return self.getGameStates()
+
+    # returns the states of all games, same layout as FlappyBird.getGameState()
+    def getGameStates(self):
+        # the nearest pipe is the first one, unless the bird has already passed it
+        chosen = (self.pipeX[:, 0] + PIPE_WIDHT < BIRD_X).astype(np.int64)
+        bottom_y = SCREEN_HEIGHT - self.pipeSize[self._rows, chosen]
+
+        states = np.empty((self.numEnvs, 5), dtype=np.float32)
+        states[:, 0] = bottom_y - PIPE_GAP
+        states[:, 1] = bottom_y
+        states[:, 2] = bottom_y - (PIPE_GAP / 2)
+        states[:, 3] = self.birdY
+        states[:, 4] = self.birdSpeed
+        return states
+
+    # advance all the games by 1 frame, returns (states[N,5], rewards[N], dones[N])
+    def step(self, actions):
+        actions = np.asarray(actions)
+        self.frames += 1
+
+        # take action, the bird can't bump itself above the screen
+        bump = actions == 1
+        self.birdSpeed[bump] = -SPEED
+        self.birdY[bump] = np.maximum(self.birdY[bump], 0)
+
+        # drop the first pipe pair once it is off screen and spawn a new one at the end
+        off = self.pipeX[:, 0] < -PIPE_WIDHT
+        if off.any():
+            rows = np.flatnonzero(off)
+            for arr in (self.pipeX, self.pipeSize, self.hasPortal, self.rewardTaken, self.portalTaken):
+                arr[rows, :-1] = arr[rows, 1:]
+            self.pipeX[rows, -1] = DEFAULT_PIPE_SPAWN_POINT
+            self._randomizePipes(rows, np.full(len(rows), NUM_PIPES - 1))
+
+        # move the bird and the pipes. Positions are truncated to ints like pygame's Rect.
+        self.birdSpeed = np.minimum(self.birdSpeed + GRAVITY, MAXSPEED)
+        self.birdY = np.trunc(self.birdY + self.birdSpeed)
+        self.pipeX -= GAME_SPEED
+
+        bird_top = self.birdY[:, None]
+        bird_bottom = bird_top + BIRD_HEIGHT
+
+        # check for collisions with the ground, the top boundary and the pipes
+        gap_bottom = SCREEN_HEIGHT - self.pipeSize
+        gap_top = gap_bottom - PIPE_GAP
+        in_pipe_column = (self.pipeX < BIRD_X + BIRD_WIDHT) & (self.pipeX + PIPE_WIDHT > BIRD_X)
+        outside_gap = (bird_top < gap_top) | (bird_bottom > gap_bottom)
+        dones = ((self.birdY + BIRD_HEIGHT > SCREEN_HEIGHT - GROUND_HEIGHT) |
+                 ((self.birdY <= 0) & (self.birdY + BIRD_HEIGHT > 0)) |
+                 (in_pipe_column & outside_gap).any(axis=1))
+
+        # check if the bird has crossed a reward line
+        reward_x = self.pipeX + REWARD_OFFSET
+        got_reward = ((reward_x < BIRD_X + BIRD_WIDHT) & (reward_x + REWARD_WIDHT > BIRD_X)) & ~self.rewardTaken
+        self.rewardTaken |= got_reward
+        got_reward = got_reward.any(axis=1)
+        self.scores += got_reward
+
+        # check if the bird has entered a portal
+        portal_x = self.pipeX + PORTAL_OFFSET_X
+        portal_y = gap_bottom + PORTAL_OFFSET_Y
+        portal_reward = (self.hasPortal & ~self.portalTaken &
+                         (portal_x < BIRD_X + BIRD_WIDHT) & (portal_x + PORTAL_WIDHT > BIRD_X) &
+                         (portal_y < bird_bottom) & (portal_y + PORTAL_HEIGHT > bird_top))
+        self.portalTaken |= portal_reward
+        portal_reward = portal_reward.any(axis=1)
+
+        # rewards, with the same priorities as getReward()
+        rewards = np.where(got_reward, PIPE_REWARD,
+                  np.where(portal_reward, PORTAL_REWARD,
+                  np.where(dones, DEATH_REWARD, ALIVE_REWARD))).astype(np.float32)
+
+        # remember the results of the finished games, then restart them. The states returned for
+        # finished games are the first states of their new games.
+        if dones.any():
+            self.finishedScores[dones] = self.scores[dones]
+            self.finishedFrames[dones] = self.frames[dones]
+            states = self.reset(dones)
+        else:
+            states = self.getGameStates()
+
+        return states, rewards, dones
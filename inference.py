@@ -0,0 +1,117 @@
+import numpy as np
+import os
+
+
+# NumPy copy of the Brain network (Dense relu -> Dense relu -> Dense linear) used for acting. Calling the Keras
+# model on a single state costs far more than the matmuls themselves, and this also works without TensorFlow.
+class NumpyBrain():
+    def __init__(self, weights=None):
+        self.layers = []
+        # version of the weights currently loaded, compared against Dqn.weightsVersion
+        self.version = -1
+        if weights is not None:
+            self.setWeights(weights)
+
+    # weights are in the same order as keras' get_weights(): kernel and bias of each Dense layer
+    def setWeights(self, weights, version=-1):
+        self.layers = [(np.asarray(kernel, dtype=np.float32), np.asarray(bias, dtype=np.float32))
+                       for kernel, bias in zip(weights[::2], weights[1::2])]
+        self.version = version
+
+    # Q-values for a batch of states
+    def predictBatch(self, states):
+        x = np.asarray(states, dtype=np.float32)
+        for kernel, bias in self.layers[:-1]:
+            x = np.maximum(x @ kernel + bias, 0)
+        kernel, bias = self.layers[-1]
+        return x @ kernel + bias
+
+    # Q-values for a single state
+    def predict(self, state):
+        return self.predictBatch(np.reshape(state, (1, -1)))[0]
+
+    # greedy action for a single state
+    def act(self, state):
+        return int(np.argmax(self.predict(state)))
+
+    # greedy actions for a batch of states
+    def actBatch(self, states):
+        return np.argmax(self.predictBatch(states), axis=1)
+
+    # bytes taken by the weights
+    def nbytes(self):
+        return sum(kernel.nbytes + bias.nbytes for kernel, bias in self.layers)
+
+
+# NumpyBrain with int8 weights, quantized per output channel with scale = max |w| / 127. The inputs of the
+# quantized layers are quantized per state on the fly and the products are summed exactly, then rescaled to
+# float32, like an int8 runtime would. NumPy has no int8 matmul kernel, so the sums are done with the float32
+# one, which is exact as long as they stay below 2^24 (up to 1040 inputs per layer). The first layer stays in
+# float32: it is tiny, and its inputs (pipe positions in pixels next to the bird's speed) don't share a useful
+# scale. quantize.py uses it to measure the accuracy of int8 weights. It is slower than NumpyBrain, so int8
+# acting goes through the TensorFlow Lite export instead.
+class QuantizedNumpyBrain(NumpyBrain):
+    def setWeights(self, weights, version=-1):
+        kernel, bias = weights[0], weights[1]
+        self.first = (np.asarray(kernel, dtype=np.float32), np.asarray(bias, dtype=np.float32))
+
+        self.layers = []
+        for kernel, bias in zip(weights[2::2], weights[3::2]):
+            kernel = np.asarray(kernel, dtype=np.float32)
+            scale = np.abs(kernel).max(axis=0) / 127
+            scale[scale == 0] = 1
+            self.layers.append((np.round(kernel / scale).astype(np.int8), scale.astype(np.float32),
+                                np.asarray(bias, dtype=np.float32)))
+        self.version = version
+
+    def predictBatch(self, states):
+        kernel, bias = self.first
+        x = np.maximum(np.asarray(states, dtype=np.float32) @ kernel + bias, 0)
+        for i, (kernel, scale, bias) in enumerate(self.layers):
+            inputScale = np.abs(x).max(axis=1, keepdims=True) / 127
+            inputScale[inputScale == 0] = 1
+            quantized = np.round(x / inputScale).astype(np.int8)
+            x = (quantized.astype(np.float32) @ kernel.astype(np.float32)) * (inputScale * scale) + bias
+            if i < len(self.layers) - 1:
+                x = np.maximum(x, 0)
+        return x.astype(np.float32)
+
+    # bytes taken by the weights
+    def nbytes(self):
+        return sum(array.nbytes for array in self.first) + sum(a.nbytes for layer in self.layers for a in layer)
+
+
+# Runs a TensorFlow Lite model exported by quantize.py, e.g. the full int8 one, with the NumpyBrain interface.
+# Uses the LiteRT interpreter if it is installed, otherwise the one bundled with TensorFlow.
+class TFLiteBrain(NumpyBrain):
+    def __init__(self, path):
+        super().__init__()
+        self.modelBytes = os.path.getsize(path)
+        try:
+            from ai_edge_litert.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+        self.interpreter = Interpreter(model_path=path)
+        self.input = self.interpreter.get_input_details()[0]["index"]
+        self.output = self.interpreter.get_output_details()[0]["index"]
+        self.batchSize = None
+
+    def predictBatch(self, states):
+        states = np.asarray(states, dtype=np.float32)
+        if len(states) != self.batchSize:
+            self.interpreter.resize_tensor_input(self.input, states.shape)
+            self.interpreter.allocate_tensors()
+            self.batchSize = len(states)
+        self.interpreter.set_tensor(self.input, states)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output)
+
+    # bytes taken by the model, weights included
+    def nbytes(self):
+        return self.modelBytes
+
+
+# where quantize.py writes the int8 TensorFlow Lite model of a weights file by default
+def int8ModelPath(weights):
+    return weights.replace(".weights.h5", "") + ".int8.tflite"
@@ -1,17 +1,33 @@
-from flappybirdenv.flappybird import FlappyBird
+from flappybirdenv.flappybird import FlappyBird, GameSnapshot
+from flappybirdenv.flappybird_rewards import getReward
 from dqn import Dqn
+from scheduler import TrainingScheduler
 import numpy as np
 import keras
 import yaml
+import json
+import os
+import time
 from datetime import datetime
+from metrics import MetricsLogger
+from profiling import PhaseTimer
+from checkpoint import Checkpointer
+from trajectory import TrajectoryRecorder, loadIntoMemory
+from flappybirdenv.flappybird_render import FrameCapture
 keras.utils.disable_interactive_logging()
 
 
+# columns of the metrics log, one row per game
+METRICS_FIELDS = ["epoch", "frames", "reward", "pipes", "portals", "epsilon", "updates", "loss",
+                  "td_error_mean", "td_error_max", "steps_per_sec"]
+
+
 class Agent():
-    def __init__(self):
-        parameters = None
-        with open("hyperparameters.yml", "r") as parameters_file:
-            parameters = yaml.safe_load(parameters_file)
+    # parameters defaults to the contents of hyperparameters.yml
+    def __init__(self, parameters=None):
+        if parameters is None:
+            with open("hyperparameters.yml", "r") as parameters_file:
+                parameters = yaml.safe_load(parameters_file)
 
         self.learningRate = parameters["learningRate"]
         self.maxMemory = parameters["maxMemory"]
@@ -24,10 +40,63 @@ class Agent():
         self.ddqn_enable = parameters["ddqn_enable"]
         self.tau = parameters["tau"]
         self.training = parameters["train"]
+        self.seed = parameters["seed"]
+        self.headless = parameters["headless"]
+        self.exact_collision = parameters["exact_collision"]
+        # frames each action is repeated for, the agent only decides (and learns) every action_repeat frames
+        self.action_repeat = parameters["action_repeat"]
+        self.prioritized_replay = parameters["prioritized_replay"]
+        self.per_alpha = parameters["per_alpha"]
+        self.per_beta = parameters["per_beta"]
+        self.per_beta_increment = parameters["per_beta_increment"]
+        self.xla_enable = parameters["xla_enable"]
+        self.brain_precision = parameters["brain_precision"]
+        self.n_step = parameters["n_step"]
+        self.n_step_lambda = parameters["n_step_lambda"]
+        self.n_step_window = parameters["n_step_window"]
+        self.replay_backend = parameters["replay_backend"]
+        self.replay_path = parameters["replay_path"]
+        self.replay_reuse = parameters["replay_reuse"]
+
+        # actor/learner mode, see distributed.py
+        self.num_actors = parameters["num_actors"]
+        self.actor_epsilon = parameters["actor_epsilon"]
+        self.actor_epsilon_alpha = parameters["actor_epsilon_alpha"]
+        self.actor_chunk_size = parameters["actor_chunk_size"]
+        self.weight_sync_interval = parameters["weight_sync_interval"]
+
+        # how often to train and sync the target network
+        self.scheduler = TrainingScheduler(trainEvery=parameters["train_every"],
+                                           gradientSteps=parameters["gradient_steps"],
+                                           warmupFrames=parameters["warmup_frames"],
+                                           targetUpdateMode=parameters["target_update_mode"],
+                                           targetUpdateInterval=parameters["target_update_interval"])
 
-        # Initialize environment, and the experience replay memory
-        self.DQN = Dqn(hidden_nodes=self.hidden_nodes, lr=self.learningRate, maxMemory=self.maxMemory, discount=self.gamma)
-        self.weights_file_name = "dqntrain.weights.h5"
+        # seed python, numpy and tensorflow (weight initialization), and keep a generator for exploration
+        if self.seed is not None:
+            keras.utils.set_random_seed(self.seed)
+        self.rng = np.random.default_rng(self.seed)
+
+        # resumable checkpoints of the whole training state every checkpoint_every games (0 disables them), resume is
+        # "latest" or the path of a checkpoint
+        self.checkpoint_every = parameters["checkpoint_every"]
+        self.checkpointer = Checkpointer(parameters["checkpoint_dir"], keep=parameters["checkpoint_keep"])
+        resume = parameters["resume"]
+        if resume == "latest":
+            resume = self.checkpointer.latest()
+
+        # Initialize environment, and the experience replay memory. An on-disk memory is only reopened with its
+        # transitions when resuming or with replay_reuse, otherwise a new run starts from an empty one.
+        self.DQN = Dqn(hidden_nodes=self.hidden_nodes, lr=self.learningRate, maxMemory=self.maxMemory, discount=self.gamma,
+                       prioritized=self.prioritized_replay, alpha=self.per_alpha, beta=self.per_beta,
+                       betaIncrement=self.per_beta_increment, ddqn=True, jit_compile=self.xla_enable,
+                       nStep=self.n_step, nStepLambda=self.n_step_lambda, nStepWindow=self.n_step_window,
+                       replayBackend=self.replay_backend, replayPath=self.replay_path,
+                       replayOverwrite=resume is None and not self.replay_reuse,
+                       precision=self.brain_precision, seed=self.seed)
+        if self.replay_backend == "memmap" and self.DQN.memory.reopened:
+            print(f"reopened replay memory {self.replay_path} with {len(self.DQN.memory)} transitions")
+        self.weights_file_name = parameters["weights_file"]
         if not self.training:
             self.DQN.load_weights(self.weights_file_name)
 
@@ -37,40 +106,168 @@ class Agent():
         self.nextState = np.zeros((1, 5))
         self.totReward = 0
 
-        # Create a new log file and log the parameters
-        self.log_file = f"./logs/log{datetime.now().strftime('%m-%d--%H-%M')}.txt"
+        # statistics of the gradient steps since the last logged game
+        self.resetTrainingStats()
+
+        # Create a new metrics log and log the parameters
+        os.makedirs(parameters["log_dir"], exist_ok=True)
+        log_name = os.path.join(parameters["log_dir"], f"log{datetime.now().strftime('%m-%d--%H-%M')}")
+        self.log_file = f"{log_name}.{parameters['metrics_format']}"
+        self.metrics = MetricsLogger(self.log_file, METRICS_FIELDS, flushEvery=parameters["metrics_flush_every"],
+                                     tensorboardDir=parameters["tensorboard_dir"])
+
+        self.log_parameters(parameters, f"{log_name}.params.json")
 
-        self.log_parameters()
+        # record the games to a trajectory file next to the log. Recorded games are reset with a seed derived
+        # from the run's seed and the epoch, which is kept in the trajectory file.
+        self.recorder = None
+        if parameters["record_trajectories"]:
+            self.recorder = TrajectoryRecorder(f"{log_name}.traj")
+        self.episodeSeedEntropy = np.random.SeedSequence(self.seed).entropy
+
+        # optional per phase timers of the training loop, and a profile of a window of games written to a directory
+        # next to the log
+        self.timer = PhaseTimer(f"{log_name}.phases.{parameters['metrics_format']}",
+                                enabled=parameters["profile_phases"],
+                                reportEvery=parameters["profile_report_every"],
+                                profiler=parameters["profiler"],
+                                profileStart=parameters["profile_start_epoch"],
+                                profileEpochs=parameters["profile_epochs"],
+                                profileDir=f"{log_name}.profile")
 
         # Create game environment
-        self.env = FlappyBird()
+        self.env = FlappyBird(headless=self.headless, exact_collision=self.exact_collision, seed=self.seed)
+
+        # capture every capture_every-th game offscreen, written by a background thread (0 disables it).
+        # Created after the game, so the renderer uses the game's window or offscreen mode
+        self.capture_every = parameters["capture_every"]
+        self.capture = None
+        if self.capture_every:
+            self.capture = FrameCapture(parameters["capture_dir"], format=parameters["capture_format"],
+                                        queueSize=parameters["capture_queue_size"])
+
+        # restore the run, once everything it covers exists
+        if resume is not None:
+            self.restoreCheckpoint(resume)
+
+        # fill the replay memory with recorded games before training, unless the run is resumed
+        elif self.training and parameters["prefill_trajectories"]:
+            loadIntoMemory(self.DQN, parameters["prefill_trajectories"])
+
+
+    # buffer the metrics of a finished game, along with the training statistics since the last one
+    def log_default(self, epoch, totReward, epsilon, score, frames=None, portals=None, seconds=None):
+        self.metrics.log(epoch,
+                         epoch=epoch, frames=frames, reward=totReward, pipes=score, portals=portals, epsilon=epsilon,
+                         updates=self.updates,
+                         loss=self.lossSum / self.updates if self.updates else None,
+                         td_error_mean=self.tdErrorSum / self.updates if self.updates else None,
+                         td_error_max=self.tdErrorMax if self.updates else None,
+                         steps_per_sec=frames / seconds if frames and seconds else None)
+        self.resetTrainingStats()
+
+    def resetTrainingStats(self):
+        self.updates = 0
+        self.lossSum = 0.
+        self.tdErrorSum = 0.
+        self.tdErrorMax = 0.
 
+    # the parameters are written once, next to the metrics
+    def log_parameters(self, parameters, fname):
+        with open(fname, "w") as f:
+            json.dump(parameters, f, indent=2)
 
-    def log_default(self, epoch, totReward, epsilon, score, mode="+a"):
-        with open(self.log_file, mode) as log:
-            log.write(
-                f"{datetime.now()}: epoch: {epoch} | totalReward = {totReward} | epsilon = {epsilon} | pipes passed = {score}\n")
+    # Save the networks, the optimizer, the replay memory and the state of the training loop. Should be called
+    # between games, when no n-step transitions are pending.
+    def saveCheckpoint(self):
+        arrays, memory = self.DQN.memory.getState()
+        metadata = {"epoch": self.epoch, "epsilon": self.epsilon, "rng": self.rng.bit_generator.state,
+                    "env": self.env.snapshot(), "scheduler": self.scheduler.getState(), "memory": memory}
+        self.checkpointer.save(self.epoch, self.DQN.trackables(), arrays, metadata)
 
-    def log_parameters(self, mode="a"):
-        with open("hyperparameters.yml", "r") as parameters_file:
-            parameters = yaml.safe_load(parameters_file)
+    def restoreCheckpoint(self, path):
+        arrays, metadata = self.checkpointer.load(path, self.DQN.trackables())
+        self.DQN.restored()
+        self.DQN.memory.setState(arrays, metadata["memory"])
+        self.scheduler.setState(metadata["scheduler"])
+        self.epoch = metadata["epoch"]
+        self.epsilon = metadata["epsilon"]
+        self.rng.bit_generator.state = metadata["rng"]
+        # the game is restored too, the bird keeps its speed from one game to the next
+        snapshot = GameSnapshot(*metadata["env"])
+        version, state, gauss = snapshot.rng_state
+        self.env.restore(snapshot._replace(rng_state=(version, tuple(state), gauss)))
 
-        with open(self.log_file, mode) as f:
-            for key, value in parameters.items():
-                f.write(f"{key}: {value}\n")
+    # seed of a recorded game, the same for a given run seed and epoch
+    def episodeSeed(self):
+        return int(np.random.SeedSequence([self.episodeSeedEntropy, self.epoch]).generate_state(1)[0])
 
-            f.write("\n")
+    # Run the gradient steps scheduled after the current frame. Each step trains the model on a batch of
+    # transitions sampled from memory.
+    def trainStep(self):
+        for _ in range(self.scheduler.trainSteps()):
+            with self.timer.phase("get_batch"):
+                batch = self.DQN.getBatch(self.batchSize)
+            if batch is None:
+                break
+            with self.timer.phase("train_batch"):
+                loss, tdErrors = self.DQN.train_batch(batch)
+            tdErrors = np.abs(tdErrors)
+            self.updates += 1
+            self.lossSum += float(loss)
+            self.tdErrorSum += float(tdErrors.mean())
+            self.tdErrorMax = max(self.tdErrorMax, float(tdErrors.max()))
 
-    def train(self):
-        while self.epoch < 50000:
+            if self.scheduler.updateDone():
+                self.syncTarget()
+
+        if self.scheduler.frameSyncDue():
+            self.syncTarget()
+
+    # If it's a DDQN model, update the target network weights using the soft update.
+    # Can be updated using the hard update in update_target_dqn() function in dqn.py for experimentation.
+    def syncTarget(self):
+        if self.ddqn_enable:
+            with self.timer.phase("target_update"):
+                self.DQN.soft_update_target_dqn(self.tau)
+
+    # Train until maxEpochs games have been played. callback(agent, pipes_passed) is called after every game
+    # and stops the training by returning True.
+    def train(self, maxEpochs=50000, callback=None):
+        try:
+            self._train(maxEpochs, callback)
+        finally:
+            self.DQN.memory.close()
+            if self.recorder is not None:
+                self.recorder.close()
+            if self.capture is not None:
+                self.capture.close()
+            self.timer.close()
+            self.metrics.close()
+            # last, so everything else is closed if the final checkpoint failed
+            self.checkpointer.close()
+
+    def _train(self, maxEpochs, callback):
+        while self.epoch < maxEpochs:
             self.epoch += 1
+            self.timer.episodeStarted(self.epoch)
 
             # get current game state:
-            self.env.resetGame()
+            seed = self.episodeSeed() if self.recorder is not None else None
+            self.env.resetGame(seed)
             self.currentState[0] = self.env.getGameState()
+            if self.recorder is not None:
+                self.recorder.beginEpisode(seed, self.currentState, self.action_repeat)
+            capturing = self.capture is not None and self.epoch % self.capture_every == 0
+            if capturing:
+                self.capture.beginEpisode(self.epoch)
+                self.capture.frame(self.env)
             gotReward = False
             self.topCollision = False
             pipes_passed = 0
+            portals = 0
+            frames = 0
+            start = time.perf_counter()
 
             # Game loop until game is not over
             gameOver = False
@@ -79,67 +276,86 @@ class Agent():
                 # if random number is less than epsilon, take a random action, otherwise,
                 # let the model predict an action and take the action with the highest Q-value
                 action = None
-                if np.random.rand() <= self.epsilon and self.training:
+                if self.rng.random() <= self.epsilon and self.training:
                     # The bird jumps if action = 1, if action = 0, do nothing. Here, a random number is generated
                     # between 0 and 10, even though only 0 and 1 are used. If the number is not 1, then the
                     # bird does not jump. This is done to prevent the bird from jumping almost every frame, and helps
                     # with the exploration.
-                    action = np.random.randint(0, 10)
+                    action = self.rng.integers(0, 10)
 
                 else:
-                    qvalues = self.DQN.model(self.currentState)[0]
-                    action = np.argmax(qvalues)
+                    with self.timer.phase("action"):
+                        action = self.DQN.getPolicy().act(self.currentState)
 
                 # Only 1 and 0 are used. If the value is higher than 1 (as a result of taking a random action),
                 # then the action is set to 0, otherwise, it is set to 1
                 action = 0 if action != 1 else 1
 
-                # Take the action and get the game state.
-                gameOver, gotReward, portal_reward = self.env.step(action, self.epoch)
-                self.nextState[0] = self.env.getGameState()
-
-                # rewards:
-                if gotReward:
-                    reward_this_round = 10.  # Higher reward for passing pipes
-                    pipes_passed += 1
-                elif portal_reward:
-                    reward_this_round = 5.   # Reward for entering portals
-                elif gameOver:
-                    reward_this_round = -10. # Higher penalty for dying
-                else:
-                    reward_this_round = 0.1  # Small reward for staying alive
+                # Take the action for action_repeat frames (or until the game is over), adding up the rewards,
+                # and get the game state.
+                reward_this_round = 0
+                pipes_before, portals_before = pipes_passed, portals
+                for _ in range(self.action_repeat):
+                    with self.timer.phase("env_step"):
+                        gameOver, gotReward, portal_reward = self.env.step(action, self.epoch)
+                    if capturing:
+                        with self.timer.phase("capture"):
+                            self.capture.frame(self.env)
+
+                    # rewards:
+                    reward_this_round += getReward(gameOver, gotReward, portal_reward)
+                    if gotReward:
+                        pipes_passed += 1
+                    if portal_reward:
+                        portals += 1
+                    frames += 1
+                    if gameOver:
+                        break
+
+                with self.timer.phase("get_state"):
+                    self.nextState[0] = self.env.getGameState()
 
-                # Remeber new experience
+                if self.recorder is not None:
+                    with self.timer.phase("record"):
+                        self.recorder.add(action, reward_this_round, self.nextState, gameOver,
+                                          pipes_passed > pipes_before, portals > portals_before)
+
+                # Remeber new experience and train if it's time to
                 if self.training:
-                    self.DQN.remember([np.copy(self.currentState), action, reward_this_round, np.copy(self.nextState)], gameOver)
+                    with self.timer.phase("remember"):
+                        self.DQN.remember([self.currentState, action, reward_this_round, self.nextState], gameOver)
+                    self.trainStep()
 
                 self.currentState = np.copy(self.nextState)
                 self.totReward += reward_this_round
 
+            if capturing:
+                self.capture.endEpisode()
+
             # Log the current epoch's information
-            self.log_default(self.epoch, self.totReward, self.epsilon, pipes_passed)
+            with self.timer.phase("log"):
+                self.log_default(self.epoch, self.totReward, self.epsilon, pipes_passed, frames, portals,
+                                 time.perf_counter() - start)
 
-            # Train the model on the current state and the expected values of the action taken (Q values). Get these
-            # vlaues from the getBatch() function then feed it into the model for training.
             if self.training:
-                inputs, targets = self.DQN.getBatch(self.batchSize, True)
-                if inputs is not None and targets is not None:
-                    # self.DQN.model.train_on_batch(inputs, targets)
-                    self.DQN.train_batch(inputs, targets)
-
                 # Save the weights after 100 epochs
                 if self.epoch % 100 == 0:
-                    self.DQN.save_weights(self.weights_file_name)
-
-                # If it's a DDQN model, update the target network weights using the soft update.
-                # Can be updated using the hard update in update_target_dqn() function in dqn.py for experimentation.
-                if self.ddqn_enable:
-                    self.DQN.soft_update_target_dqn(self.tau)
+                    with self.timer.phase("save_weights"):
+                        self.DQN.save_weights(self.weights_file_name)
 
                 # decrease epsilon and reset the total reward for this epoch
                 self.epsilon = max(self.epsilon * self.epsilonDecayRate, self.epsilonMin)
                 self.totReward = 0
 
+                if self.checkpoint_every and self.epoch % self.checkpoint_every == 0:
+                    with self.timer.phase("checkpoint"):
+                        self.saveCheckpoint()
+
+            self.timer.episodeDone(self.epoch)
+
+            if callback is not None and callback(self, pipes_passed):
+                break
+
 
 if __name__ == "__main__":
     agent = Agent()
@@ -0,0 +1,67 @@
+import csv
+import json
+import os
+import time
+
+
+# Buffered metrics sink. Records are kept in memory and appended to a CSV or JSONL file every flushEvery records,
+# instead of opening the log file for every game. Every record has the same columns, given by fields, plus the
+# time it was logged at. Numeric columns can also be written to TensorBoard.
+class MetricsLogger():
+    def __init__(self, path, fields, flushEvery=100, tensorboardDir=None):
+        self.path = path
+        self.fields = ["time"] + list(fields)
+        self.flushEvery = flushEvery
+        self.format = os.path.splitext(path)[1].lstrip(".")
+        if self.format not in ("csv", "jsonl"):
+            raise ValueError(f"unsupported metrics format: {self.format}")
+
+        self.records = []
+        self.writeHeader = not os.path.exists(path)
+
+        # TensorBoard is optional, and only imports TensorFlow when it is used
+        self.tensorboard = None
+        if tensorboardDir is not None:
+            import tensorflow as tf
+            self.summary = tf.summary
+            self.tensorboard = tf.summary.create_file_writer(tensorboardDir)
+
+    # buffer a record, step is the x axis used for TensorBoard
+    def log(self, step, **values):
+        record = {"time": time.time()}
+        for field in self.fields[1:]:
+            record[field] = values.get(field)
+        self.records.append(record)
+
+        if self.tensorboard is not None:
+            with self.tensorboard.as_default(step=step):
+                for field, value in values.items():
+                    if isinstance(value, (int, float)):
+                        self.summary.scalar(field, value)
+
+        if len(self.records) >= self.flushEvery:
+            self.flush()
+
+    # append the buffered records to the file in one write
+    def flush(self):
+        if not self.records:
+            return
+
+        with open(self.path, "a", newline="") as f:
+            if self.format == "csv":
+                writer = csv.DictWriter(f, fieldnames=self.fields)
+                if self.writeHeader:
+                    writer.writeheader()
+                writer.writerows(self.records)
+            else:
+                f.writelines(json.dumps(record) + "\n" for record in self.records)
+        self.writeHeader = False
+        self.records = []
+
+        if self.tensorboard is not None:
+            self.tensorboard.flush()
+
+    def close(self):
+        self.flush()
+        if self.tensorboard is not None:
+            self.tensorboard.close()
@@ -0,0 +1,111 @@
+import contextlib
+import cProfile
+import os
+import time
+from metrics import MetricsLogger
+
+
+# columns of the phase report, one row per phase and report
+PHASE_FIELDS = ["epoch", "phase", "calls", "seconds", "mean_us", "share"]
+
+# returned by PhaseTimer.phase() when the timers are disabled
+_DISABLED = contextlib.nullcontext()
+
+
+# timer of a single phase, reused by every call to PhaseTimer.phase() with the same name
+class _Phase():
+    __slots__ = ("name", "seconds", "calls", "start")
+
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.
+        self.calls = 0
+        self.start = 0.
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds += time.perf_counter() - self.start
+        self.calls += 1
+        return False
+
+
+# Opt-in instrumentation of the training loop. Code is wrapped in `with timer.phase("name"):` blocks, whose wall
+# time and call counts are added up and written to the metrics log every reportEvery games. When the timers are
+# disabled phase() returns a shared no-op context manager. A cProfile dump or a TensorFlow profiler trace can also
+# be captured for the games from profileStart to profileStart + profileEpochs - 1.
+class PhaseTimer():
+    def __init__(self, path, enabled=False, reportEvery=100, profiler=None, profileStart=1, profileEpochs=0,
+                 profileDir="./logs"):
+        if profiler not in (None, "cprofile", "tensorflow"):
+            raise ValueError(f"unknown profiler: {profiler}")
+
+        self.enabled = enabled
+        self.reportEvery = reportEvery
+        self.phases = {}
+        self.metrics = MetricsLogger(path, PHASE_FIELDS, flushEvery=1) if enabled else None
+
+        self.profiler = profiler
+        self.profileStart = profileStart
+        self.profileEnd = profileStart + profileEpochs - 1
+        self.profileDir = profileDir
+        self.profile = None
+        self.profiling = False
+
+    def phase(self, name):
+        if not self.enabled:
+            return _DISABLED
+        phase = self.phases.get(name)
+        if phase is None:
+            phase = self.phases[name] = _Phase(name)
+        return phase
+
+    # log the time spent in every phase since the last report, and reset the timers
+    def report(self, epoch):
+        total = sum(phase.seconds for phase in self.phases.values())
+        for phase in self.phases.values():
+            if phase.calls:
+                self.metrics.log(epoch, epoch=epoch, phase=phase.name, calls=phase.calls, seconds=phase.seconds,
+                                 mean_us=phase.seconds / phase.calls * 1e6,
+                                 share=phase.seconds / total if total else None)
+        self.phases = {}
+
+    # call when a game starts, starts the profiler on the first game of the window
+    def episodeStarted(self, epoch):
+        if self.profiler is None or epoch != self.profileStart or self.profileEnd < self.profileStart:
+            return
+
+        os.makedirs(self.profileDir, exist_ok=True)
+        if self.profiler == "cprofile":
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        else:
+            import tensorflow as tf
+            tf.profiler.experimental.start(self.profileDir)
+        self.profiling = True
+
+    # call when a game ends, stops the profiler after the last game of the window and reports the phases
+    def episodeDone(self, epoch):
+        if self.profiling and epoch >= self.profileEnd:
+            self._stopProfiler()
+
+        if self.enabled and epoch % self.reportEvery == 0:
+            self.report(epoch)
+
+    def _stopProfiler(self):
+        if self.profiler == "cprofile":
+            self.profile.disable()
+            self.profile.dump_stats(os.path.join(self.profileDir, f"profile{self.profileStart}-{self.profileEnd}.prof"))
+            self.profile = None
+        else:
+            import tensorflow as tf
+            tf.profiler.experimental.stop()
+        self.profiling = False
+
+    def close(self):
+        if self.profiling:
+            self._stopProfiler()
+        if self.metrics is not None:
+            self.metrics.close()
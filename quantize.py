@@ -0,0 +1,131 @@
+from flappybirdenv.flappybird_vector import VectorFlappyBird
+from brain import Brain
+from inference import NumpyBrain, QuantizedNumpyBrain, TFLiteBrain, int8ModelPath
+import numpy as np
+import tensorflow as tf
+import argparse
+import json
+import sys
+import time
+import yaml
+
+
+# Exports trained weights for cheaper acting and checks that the exported models still act like the float32
+# network: int8 weights in NumPy, a full int8 TensorFlow Lite model calibrated on recorded states, and the
+# float16/bfloat16 mixed precision Keras models. Every variant is compared with the float32 NumPy policy on the
+# same states, e.g. python quantize.py --states checkpoints/ckpt-1000/states.npy. The TensorFlow Lite model is the
+# one evaluate.py --policy-precision int8 plays with.
+
+
+# states visited by the greedy float32 policy, numStates // numEnvs frames of numEnvs games
+def recordStates(policy, numStates, seed, numEnvs=256):
+    env = VectorFlappyBird(numEnvs, seed=seed)
+    states = env.getGameStates()
+    recorded = []
+    for _ in range(max(numStates // numEnvs, 1)):
+        recorded.append(states)
+        states, _, _ = env.step(policy.actBatch(states))
+    return np.concatenate(recorded)
+
+
+# Convert the network to a TensorFlow Lite model with int8 weights and activations, the quantization ranges of
+# the activations are calibrated on the given states. The weights are baked in as constants.
+def exportTFLite(weights, states, path):
+    layers = list(zip(weights[::2], weights[1::2]))
+
+    @tf.function(input_signature=[tf.TensorSpec([1, states.shape[1]], tf.float32)])
+    def predict(x):
+        for i, (kernel, bias) in enumerate(layers):
+            x = tf.matmul(x, tf.constant(kernel)) + tf.constant(bias)
+            if i < len(layers) - 1:
+                x = tf.nn.relu(x)
+        return x
+
+    converter = tf.lite.TFLiteConverter.from_concrete_functions([predict.get_concrete_function()])
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    calibration = states[np.random.default_rng(0).permutation(len(states))[:1000]]
+    converter.representative_dataset = lambda: ([state[None]] for state in calibration)
+    model = converter.convert()
+    with open(path, "wb") as f:
+        f.write(model)
+    return len(model)
+
+
+# Keras model with the given dtype policy and the same weights, with the NumpyBrain prediction interface
+class KerasPolicy():
+    def __init__(self, weights, hidden_nodes, precision):
+        self.model = Brain(hidden_nodes, 5, 2, 0.001, precision).model
+        self.model.set_weights(weights)
+        self.predict = tf.function(self.model)
+
+    def predictBatch(self, states):
+        return self.predict(np.asarray(states, dtype=np.float32)).numpy()
+
+
+# agreement of the greedy actions and differences of the Q-values with the reference policy, and latencies
+def compare(reference, policy, states):
+    expected = reference.predictBatch(states)
+    predicted = np.concatenate([policy.predictBatch(states[i:i + 256]) for i in range(0, len(states), 256)])
+    error = np.abs(predicted - expected)
+
+    start = time.perf_counter()
+    for state in states[:1000]:
+        policy.predictBatch(state[None])
+    single = (time.perf_counter() - start) / min(len(states), 1000) * 1e6
+
+    batch = states[:256]
+    start = time.perf_counter()
+    for _ in range(100):
+        policy.predictBatch(batch)
+    batched = (time.perf_counter() - start) / (100 * len(batch)) * 1e6
+
+    return {"action_agreement": float(np.mean(predicted.argmax(axis=1) == expected.argmax(axis=1))),
+            "q_error_mean": float(error.mean()), "q_error_max": float(error.max()),
+            "latency_us": single, "batched_us_per_state": batched}
+
+
+def main():
+    with open("hyperparameters.yml", "r") as parameters_file:
+        parameters = yaml.safe_load(parameters_file)
+
+    parser = argparse.ArgumentParser(description="Quantized and mixed precision exports of Flappy Bird DQN weights")
+    parser.add_argument("--weights", default=parameters["weights_file"])
+    parser.add_argument("--states", default=None, help=".npy file of states to compare on, e.g. from a checkpoint")
+    parser.add_argument("--record", type=int, default=20000, help="states to record when --states isn't given")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tflite", default=None, help="where to write the int8 TensorFlow Lite model")
+    parser.add_argument("--min-agreement", type=float, default=0.99,
+                        help="exit with an error if an int8 export agrees on fewer greedy actions")
+    args = parser.parse_args()
+
+    model = Brain(parameters["hidden_nodes"], 5, 2, 0.001).model
+    model.load_weights(args.weights)
+    weights = model.get_weights()
+    reference = NumpyBrain(weights)
+
+    if args.states is not None:
+        states = np.asarray(np.load(args.states, mmap_mode="r"), dtype=np.float32)
+    else:
+        states = recordStates(reference, args.record, args.seed)
+
+    int8 = QuantizedNumpyBrain(weights)
+    results = {"states": len(states),
+               "float32": dict(compare(reference, reference, states), weight_bytes=reference.nbytes()),
+               "int8": dict(compare(reference, int8, states), weight_bytes=int8.nbytes())}
+    for precision in ("mixed_float16", "mixed_bfloat16"):
+        results[precision] = compare(reference, KerasPolicy(weights, parameters["hidden_nodes"], precision), states)
+
+    tflite = args.tflite or int8ModelPath(args.weights)
+    size = exportTFLite(weights, states, tflite)
+    results["tflite_int8"] = dict(compare(reference, TFLiteBrain(tflite), states), model_bytes=size, path=tflite)
+    print(json.dumps(results, indent=2))
+
+    failed = [name for name in ("int8", "tflite_int8") if results[name]["action_agreement"] < args.min_agreement]
+    if failed:
+        print(f"greedy action agreement below {args.min_agreement}: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+from flappybirdenv.flappybird import FlappyBird
+from flappybirdenv.flappybird_render import FrameCapture, CAPTURE_FORMATS
+from trajectory import readEpisodes, replayEpisode
+import argparse
+import time
+
+
+# Renders recorded games (see trajectory.py) offscreen, by playing them again headless from their seed and
+# capturing the frames, e.g. python render.py logs/log10-18--12-00.traj --every 100
+def main():
+    parser = argparse.ArgumentParser(description="Render recorded Flappy Bird games to PNG or raw RGB frames")
+    parser.add_argument("trajectory")
+    parser.add_argument("--output", default="./captures")
+    parser.add_argument("--format", default="png", choices=CAPTURE_FORMATS)
+    parser.add_argument("--every", type=int, default=1, help="render every Nth game of the file")
+    parser.add_argument("--games", type=int, default=None, help="stop after rendering this many games")
+    parser.add_argument("--queue-size", type=int, default=256)
+    args = parser.parse_args()
+
+    game = FlappyBird(headless=True)
+    capture = FrameCapture(args.output, format=args.format, queueSize=args.queue_size)
+
+    rendered = 0
+    start = time.perf_counter()
+    for i, episode in enumerate(readEpisodes(args.trajectory)):
+        if i % args.every != 0:
+            continue
+        if args.games is not None and rendered == args.games:
+            break
+
+        # files are named after the game's position in the trajectory file
+        capture.beginEpisode(i)
+        for _ in replayEpisode(game, episode):
+            capture.frame(game)
+        capture.endEpisode()
+        rendered += 1
+
+    capture.close()
+    print(f"rendered {rendered} games to {args.output} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,397 @@
+import json
+import os
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+# names of the arrays a transition is stored in
+TRANSITION_ARRAYS = ("states", "actions", "rewards", "nextStates", "gameOvers", "discounts")
+
+
+# Experience replay memory stored in preallocated, contiguous arrays. It works as a ring buffer: once it is
+# full, every new transition overwrites the oldest one. Every transition keeps the factor its next state's
+# Q-value is discounted by in the target, gamma * (1 - gameOver) for one step transitions.
+class ReplayMemory():
+    def __init__(self, maxMemory, stateSize=5, seed=None):
+        self.maxMemory = maxMemory
+        self.rng = np.random.default_rng(seed)
+
+        self.states = np.zeros((maxMemory, stateSize), dtype=np.float32)
+        self.actions = np.zeros(maxMemory, dtype=np.int8)
+        self.rewards = np.zeros(maxMemory, dtype=np.float32)
+        self.nextStates = np.zeros((maxMemory, stateSize), dtype=np.float32)
+        self.gameOvers = np.zeros(maxMemory, dtype=bool)
+        self.discounts = np.zeros(maxMemory, dtype=np.float32)
+
+        # index of the next slot to write and number of stored transitions
+        self.position = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    # store a transition, overwriting the oldest one if the memory is full
+    def add(self, state, action, reward, nextState, gameOver, discount):
+        i = self.position
+        self.states[i] = np.reshape(state, -1)
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self.nextStates[i] = np.reshape(nextState, -1)
+        self.gameOvers[i] = gameOver
+        self.discounts[i] = discount
+
+        self.position = (i + 1) % self.maxMemory
+        self.size = min(self.size + 1, self.maxMemory)
+
+    # store a batch of transitions at once, returns the indices they were written to
+    def addBatch(self, states, actions, rewards, nextStates, gameOvers, discounts):
+        indices = (self.position + np.arange(len(actions))) % self.maxMemory
+        self.states[indices] = states
+        self.actions[indices] = actions
+        self.rewards[indices] = rewards
+        self.nextStates[indices] = nextStates
+        self.gameOvers[indices] = gameOvers
+        self.discounts[indices] = discounts
+
+        self.position = (self.position + len(actions)) % self.maxMemory
+        self.size = min(self.size + len(actions), self.maxMemory)
+        return indices
+
+    # returns the transitions stored at indices as (states, actions, rewards, nextStates, gameOvers, discounts)
+    def getTransitions(self, indices):
+        return (self.states[indices], self.actions[indices], self.rewards[indices],
+                self.nextStates[indices], self.gameOvers[indices], self.discounts[indices])
+
+    # randomly sample a batch of transitions, returns (indices, transitions, importance sampling weights).
+    # Uniform sampling doesn't need any weights, so they are None.
+    def sample(self, batchSize):
+        indices = self.rng.integers(0, self.size, size=batchSize)
+        return indices, self.getTransitions(indices), None
+
+    # uniform sampling ignores the TD errors of the sampled transitions
+    def updatePriorities(self, indices, tdErrors):
+        pass
+
+    # returns (arrays, metadata) with copies of the stored transitions and what is needed to restore the memory
+    def getState(self):
+        arrays = {name: getattr(self, name)[:self.size].copy() for name in TRANSITION_ARRAYS}
+        metadata = {"position": self.position, "size": self.size, "rng": self.rng.bit_generator.state}
+        return arrays, metadata
+
+    # restore the memory from the arrays and metadata of getState()
+    def setState(self, arrays, metadata):
+        size = metadata["size"]
+        if size > self.maxMemory:
+            raise ValueError(f"can't restore {size} transitions into a memory of {self.maxMemory}")
+        for name in TRANSITION_ARRAYS:
+            getattr(self, name)[:size] = arrays[name]
+        self.position = metadata["position"] % self.maxMemory
+        self.size = size
+        self.rng.bit_generator.state = metadata["rng"]
+
+    # nothing to write back for in-memory arrays
+    def close(self):
+        pass
+
+
+# layout of a transition in MemmapReplayMemory
+def recordDtype(stateSize):
+    return np.dtype([("states", np.float32, (stateSize,)), ("actions", np.int8), ("rewards", np.float32),
+                     ("nextStates", np.float32, (stateSize,)), ("gameOvers", np.bool_), ("discounts", np.float32)])
+
+
+# Replay memory stored in a memory mapped .npy file of fixed size records, so its capacity is limited by the
+# disk instead of the RAM. The transition arrays of ReplayMemory are views of the record fields, and a batch is
+# read with a single gather of whole records. The write position and size are kept in path + ".json", written by
+# flush() every flushEvery transitions and on checkpoints, so an existing file is reopened with its transitions
+# unless overwrite is set, and a run that is killed loses at most flushEvery of them.
+class MemmapReplayMemory(ReplayMemory):
+    def __init__(self, maxMemory, path, stateSize=5, overwrite=False, flushEvery=10000, seed=None):
+        self.maxMemory = maxMemory
+        self.path = path
+        self.headerPath = path + ".json"
+        self.flushEvery = flushEvery
+        self.rng = np.random.default_rng(seed)
+        self.position = 0
+        self.size = 0
+        self.unflushed = 0
+        # True if the transitions of an existing file were kept
+        self.reopened = False
+
+        dtype = recordDtype(stateSize)
+        if os.path.exists(path) and not overwrite:
+            self.records = np.lib.format.open_memmap(path, mode="r+")
+            if self.records.dtype != dtype or self.records.shape != (maxMemory,):
+                raise ValueError(f"{path} holds {self.records.shape[0]} records of {self.records.dtype}, "
+                                 f"expected {maxMemory} of {dtype}")
+            if os.path.exists(self.headerPath):
+                with open(self.headerPath, "r") as f:
+                    header = json.load(f)
+                self.position = header["position"]
+                self.size = header["size"]
+            self.reopened = True
+        else:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self.records = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(maxMemory,))
+            self.flush()
+
+        for name in TRANSITION_ARRAYS:
+            setattr(self, name, self.records[name])
+
+    def add(self, state, action, reward, nextState, gameOver, discount):
+        super().add(state, action, reward, nextState, gameOver, discount)
+        self._added(1)
+
+    def addBatch(self, states, actions, rewards, nextStates, gameOvers, discounts):
+        indices = super().addBatch(states, actions, rewards, nextStates, gameOvers, discounts)
+        self._added(len(actions))
+        return indices
+
+    def _added(self, count):
+        self.unflushed += count
+        if self.unflushed >= self.flushEvery:
+            self.flush()
+
+    # sorted indices read the file in order
+    def sample(self, batchSize):
+        indices = np.sort(self.rng.integers(0, self.size, size=batchSize))
+        return indices, self.getTransitions(indices), None
+
+    def getTransitions(self, indices):
+        records = self.records[indices]
+        return tuple(records[name] for name in TRANSITION_ARRAYS)
+
+    # write the records and the header to disk
+    def flush(self):
+        self.records.flush()
+        self.unflushed = 0
+        header = {"maxMemory": self.maxMemory, "position": self.position, "size": self.size}
+        with open(self.headerPath + ".tmp", "w") as f:
+            json.dump(header, f)
+        os.replace(self.headerPath + ".tmp", self.headerPath)
+
+    # The transitions already are on disk, so checkpoints only keep the counters. Restoring one reuses the
+    # file as it is.
+    def getState(self):
+        self.flush()
+        return {}, {"position": self.position, "size": self.size, "rng": self.rng.bit_generator.state,
+                    "path": self.path}
+
+    def setState(self, arrays, metadata):
+        if arrays:
+            super().setState(arrays, metadata)
+            return
+        self.position = metadata["position"]
+        self.size = metadata["size"]
+        self.rng.bit_generator.state = metadata["rng"]
+
+    def close(self):
+        self.flush()
+
+
+# Binary tree where every node holds the sum of its children, so the leaves can be sampled proportionally to
+# their values in O(log N). The leaves are stored in the second half of the array and the root at index 1.
+class SumTree():
+    def __init__(self, capacity):
+        self.capacity = 1
+        while self.capacity < capacity:
+            self.capacity *= 2
+        self.tree = np.zeros(2 * self.capacity, dtype=np.float64)
+
+    def total(self):
+        return self.tree[1]
+
+    def get(self, indices):
+        return self.tree[indices + self.capacity]
+
+    # set the value of a single leaf, walking up to the root
+    def set(self, index, value):
+        node = index + self.capacity
+        self.tree[node] = value
+        node //= 2
+        while node >= 1:
+            self.tree[node] = self.tree[2 * node] + self.tree[2 * node + 1]
+            node //= 2
+
+    # set the values of the leaves at indices and update their ancestors, one tree level at a time
+    def update(self, indices, values):
+        nodes = np.asarray(indices) + self.capacity
+        self.tree[nodes] = values
+        nodes = np.unique(nodes // 2)
+        while nodes[0] >= 1:
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+            nodes = np.unique(nodes // 2)
+
+    # find the leaves whose cumulative sum ranges contain values, descending the tree for all values at once
+    def find(self, values):
+        values = np.array(values, dtype=np.float64)
+        nodes = np.ones(len(values), dtype=np.int64)
+        while nodes[0] < self.capacity:
+            left = self.tree[2 * nodes]
+            goRight = values >= left
+            values -= left * goRight
+            nodes = 2 * nodes + goRight
+        return nodes - self.capacity
+
+
+# Replay memory that samples transitions proportionally to their TD errors (prioritized experience replay),
+# and corrects the sampling bias with importance sampling weights.
+class PrioritizedReplayMemory(ReplayMemory):
+    def __init__(self, maxMemory, stateSize=5, alpha=0.6, beta=0.4, betaIncrement=0.0001, epsilon=1e-5, seed=None):
+        super().__init__(maxMemory, stateSize, seed)
+        self.alpha = alpha
+        self.beta = beta
+        self.betaIncrement = betaIncrement
+        self.epsilon = epsilon
+
+        self.priorities = SumTree(maxMemory)
+        self.maxPriority = 1.
+
+    # new transitions get the highest priority seen so far, so they are sampled at least once
+    def add(self, state, action, reward, nextState, gameOver, discount):
+        i = self.position
+        super().add(state, action, reward, nextState, gameOver, discount)
+        self.priorities.set(i, self.maxPriority ** self.alpha)
+
+    def addBatch(self, states, actions, rewards, nextStates, gameOvers, discounts):
+        indices = super().addBatch(states, actions, rewards, nextStates, gameOvers, discounts)
+        self.priorities.update(indices, self.maxPriority ** self.alpha)
+        return indices
+
+    def sample(self, batchSize):
+        # stratified sampling: one sample from each of batchSize equal segments of the total priority
+        total = self.priorities.total()
+        values = (np.arange(batchSize) + self.rng.random(batchSize)) * (total / batchSize)
+        indices = np.minimum(self.priorities.find(values), self.size - 1)
+
+        # importance sampling weights, normalized so the largest one is 1
+        probabilities = self.priorities.get(indices) / total
+        weights = (self.size * probabilities) ** -self.beta
+        weights /= weights.max()
+        self.beta = min(self.beta + self.betaIncrement, 1.)
+
+        return indices, self.getTransitions(indices), weights.astype(np.float32)
+
+    def updatePriorities(self, indices, tdErrors):
+        priorities = np.abs(tdErrors) + self.epsilon
+        self.maxPriority = max(self.maxPriority, priorities.max())
+        self.priorities.update(indices, priorities ** self.alpha)
+
+    def getState(self):
+        arrays, metadata = super().getState()
+        arrays["priorities"] = self.priorities.get(np.arange(self.size))
+        # maxPriority comes from NumPy, the metadata is written as JSON
+        metadata.update(maxPriority=float(self.maxPriority), beta=float(self.beta))
+        return arrays, metadata
+
+    def setState(self, arrays, metadata):
+        super().setState(arrays, metadata)
+        self.priorities.update(np.arange(self.size), arrays["priorities"])
+        self.maxPriority = metadata["maxPriority"]
+        self.beta = metadata["beta"]
+
+
+# Turns the one step transitions of a game into n-step transitions. The transitions are buffered and, when the
+# game ends or the buffer holds window transitions, the returns of all the complete ones are computed at once.
+# Each n-step transition goes from a state to the state n frames later (or to the end of the game), with
+# reward = r_t + gamma r_t+1 + ... + gamma^(n-1) r_t+n-1 and discount = gamma^n * (1 - gameOver).
+#
+# With lam set, the reward is instead the lambda-return truncated at n steps, a mix of the 1..n step returns
+# weighted by (1 - lam) lam^(k-1), and lam^(n-1) for the n step one. The bootstraps of the shorter returns
+# use valueFn (max Q-value of a batch of states) at the time the returns are computed, only the last one is
+# left to the target network, discounted by lam^(n-1) gamma^n.
+class NStepBuffer():
+    def __init__(self, n, gamma, lam=None, valueFn=None, window=256):
+        if lam is not None and valueFn is None:
+            raise ValueError("lambda-returns need a value function for the intermediate bootstraps")
+        if window < n:
+            raise ValueError("the window must hold at least n transitions")
+
+        self.n = n
+        self.gamma = gamma
+        self.lam = lam
+        self.valueFn = valueFn
+        self.window = window
+        self.powers = gamma ** np.arange(n, dtype=np.float64)
+
+        self.states = []
+        self.actions = []
+        self.rewards = []
+        self.nextStates = []
+
+    def __len__(self):
+        return len(self.actions)
+
+    # buffer a one step transition, returns the n-step transitions that are complete, or None
+    def add(self, state, action, reward, nextState, gameOver):
+        # copied, the caller may reuse its state arrays
+        self.states.append(np.array(state, dtype=np.float32).reshape(-1))
+        self.actions.append(action)
+        self.rewards.append(reward)
+        self.nextStates.append(np.array(nextState, dtype=np.float32).reshape(-1))
+
+        if gameOver:
+            return self.flush(gameOver=True)
+        if len(self.actions) >= self.window:
+            return self.flush(gameOver=False)
+        return None
+
+    # Compute the n-step transitions of the buffered frames, as arrays
+    # (states, actions, rewards, nextStates, gameOvers, discounts). If the game is over every frame is
+    # returned, the last ones with shorter returns. Otherwise only the frames with n frames after them are,
+    # and the last n - 1 stay buffered.
+    def flush(self, gameOver):
+        n = self.n
+        size = len(self.actions)
+        count = size if gameOver else size - n + 1
+        if count <= 0:
+            return None
+
+        rewards = np.asarray(self.rewards, dtype=np.float64)
+        nextStates = np.asarray(self.nextStates, dtype=np.float32)
+
+        # partial[t, k] is the (k + 1)-step discounted reward sum from frame t, frames past the end count as 0
+        windows = sliding_window_view(np.concatenate([rewards, np.zeros(n - 1)]), n)[:count]
+        partial = np.cumsum(windows * self.powers, axis=1)
+
+        # horizon of every returned transition and index of its last frame
+        frames = np.arange(count)
+        horizons = np.minimum(n, size - frames)
+        last = frames + horizons - 1
+        dones = np.zeros(count, dtype=bool)
+        if gameOver:
+            dones[last == size - 1] = True
+
+        if self.lam is None:
+            returns = partial[frames, horizons - 1]
+            discounts = self.gamma ** horizons * ~dones
+        else:
+            # k-step returns are weighted by (1 - lam) lam^(k-1) for k < horizon and lam^(horizon-1) for the last
+            k = np.arange(n)
+            shorter = k < horizons[:, None] - 1
+            weights = np.where(shorter, (1 - self.lam) * self.lam ** k,
+                               np.where(k == horizons[:, None] - 1, self.lam ** k, 0.))
+
+            # bootstraps of the shorter returns, frames past the end are never used since they aren't shorter
+            values = np.asarray(self.valueFn(nextStates), dtype=np.float64)
+            bootstraps = sliding_window_view(np.concatenate([values, np.zeros(n - 1)]), n)[:count]
+            bootstraps = bootstraps * (self.gamma * self.powers)
+
+            returns = (weights * partial).sum(axis=1) + np.where(shorter, weights * bootstraps, 0.).sum(axis=1)
+            discounts = self.lam ** (horizons - 1) * self.gamma ** horizons * ~dones
+
+        transitions = (np.asarray(self.states[:count], dtype=np.float32), np.asarray(self.actions[:count]),
+                       returns.astype(np.float32), nextStates[last], dones, discounts.astype(np.float32))
+
+        if gameOver:
+            self.clear()
+        else:
+            del self.states[:count], self.actions[:count], self.rewards[:count], self.nextStates[:count]
+        return transitions
+
+    # drop the buffered frames, e.g. when a game is abandoned
+    def clear(self):
+        self.states = []
+        self.actions = []
+        self.rewards = []
+        self.nextStates = []
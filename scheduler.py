@@ -0,0 +1,39 @@
+# Decides when the agent runs gradient steps and syncs its target network, based on how many frames have been
+# played and how many updates have been made, instead of once per game.
+class TrainingScheduler():
+    def __init__(self, trainEvery, gradientSteps, warmupFrames, targetUpdateMode, targetUpdateInterval):
+        if targetUpdateMode not in ("frames", "updates"):
+            raise ValueError(f"unknown target update mode: {targetUpdateMode}")
+
+        self.trainEvery = trainEvery
+        self.gradientSteps = gradientSteps
+        self.warmupFrames = warmupFrames
+        self.targetUpdateMode = targetUpdateMode
+        self.targetUpdateInterval = targetUpdateInterval
+
+        self.frames = 0
+        self.updates = 0
+
+    # count a new frame and return the number of gradient steps to run after it
+    def trainSteps(self):
+        self.frames += 1
+        if self.frames < self.warmupFrames or self.frames % self.trainEvery != 0:
+            return 0
+        return self.gradientSteps
+
+    # count a gradient step, returns True if the target network should be synced after it
+    def updateDone(self):
+        self.updates += 1
+        return self.targetUpdateMode == "updates" and self.updates % self.targetUpdateInterval == 0
+
+    # returns True if the target network should be synced after the current frame
+    def frameSyncDue(self):
+        return self.targetUpdateMode == "frames" and self.frames % self.targetUpdateInterval == 0
+
+    # counters saved in checkpoints
+    def getState(self):
+        return {"frames": self.frames, "updates": self.updates}
+
+    def setState(self, state):
+        self.frames = state["frames"]
+        self.updates = state["updates"]
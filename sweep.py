@@ -0,0 +1,160 @@
+import multiprocessing as mp
+import argparse
+import itertools
+import os
+import time
+import numpy as np
+import yaml
+from collections import deque
+from metrics import MetricsLogger
+
+
+# Hyperparameter sweeps. A sweep file (see sweep.yml) gives a grid and/or random distributions over the keys of
+# hyperparameters.yml. Every trial trains its own headless Agent in a worker process, with its own seed and
+# output directory, and trials that fall behind are stopped early with the median stopping rule: after
+# min_epochs, every report_every games a trial compares its rolling mean of pipes passed with the median of the
+# other trials at the same epoch, and stops if it is lower. A results table is written at the end.
+
+# parameters every trial overrides, on top of the sweep's own overrides
+TRIAL_DEFAULTS = {"headless": True, "train": True, "resume": None, "profile_phases": False,
+                  "profiler": None}
+
+
+# draw a value from a random distribution of the sweep file
+def sample(rng, distribution):
+    (kind, args), = distribution.items()
+    if kind == "choice":
+        return args[int(rng.integers(len(args)))]
+    if kind == "uniform":
+        return float(rng.uniform(*args))
+    if kind == "log_uniform":
+        return float(np.exp(rng.uniform(np.log(args[0]), np.log(args[1]))))
+    if kind == "int_uniform":
+        return int(rng.integers(args[0], args[1] + 1))
+    raise ValueError(f"unknown distribution: {kind}")
+
+
+# Returns the list of trial configurations: every point of the grid, each one combined with `samples` draws
+# from the random distributions if there are any.
+def makeTrials(sweep):
+    grid = sweep.get("grid") or {}
+    distributions = sweep.get("random") or {}
+    samples = sweep.get("samples", 1) if distributions else 1
+    rng = np.random.default_rng(sweep.get("seed"))
+
+    trials = []
+    for values in itertools.product(*grid.values()):
+        for _ in range(samples):
+            trial = dict(zip(grid.keys(), values))
+            trial.update({key: sample(rng, distribution) for key, distribution in distributions.items()})
+            trials.append(trial)
+    return trials
+
+
+# Stops a trial when its rolling mean of pipes passed is below the median of the other trials at the same epoch.
+# The reports of all the trials are kept in a dict shared between the workers.
+class MedianStopping():
+    def __init__(self, trialId, reports, window, reportEvery, minEpochs, minTrials):
+        self.trialId = trialId
+        self.reports = reports
+        self.pipes = deque(maxlen=window)
+        self.reportEvery = reportEvery
+        self.minEpochs = minEpochs
+        self.minTrials = minTrials
+        self.best = 0.
+        self.stopped = False
+
+    def rolling(self):
+        return float(np.mean(self.pipes)) if self.pipes else 0.
+
+    def __call__(self, agent, pipes_passed):
+        self.pipes.append(pipes_passed)
+        if agent.epoch % self.reportEvery != 0:
+            return False
+
+        value = self.rolling()
+        self.best = max(self.best, value)
+        self.reports[(self.trialId, agent.epoch)] = value
+        if agent.epoch < self.minEpochs:
+            return False
+
+        others = [v for (trialId, epoch), v in self.reports.items() if epoch == agent.epoch and trialId != self.trialId]
+        if len(others) >= self.minTrials and value < np.median(others):
+            self.stopped = True
+        return self.stopped
+
+
+# worker process: train one trial and return its results
+def runTrial(trialId, trial, parameters, sweep, directory, reports):
+    from main import Agent
+
+    parameters = dict(parameters, **TRIAL_DEFAULTS)
+    parameters.update(sweep.get("overrides") or {})
+    parameters.update(trial)
+    parameters["seed"] = sweep.get("seed", 0) + trialId
+
+    # every trial writes to its own directory
+    trialDirectory = os.path.join(directory, f"trial{trialId}")
+    parameters["log_dir"] = trialDirectory
+    parameters["checkpoint_dir"] = os.path.join(trialDirectory, "checkpoints")
+    parameters["weights_file"] = os.path.join(trialDirectory, "dqntrain.weights.h5")
+    parameters["replay_path"] = os.path.join(trialDirectory, "memory.npy")
+    parameters["capture_dir"] = os.path.join(trialDirectory, "captures")
+
+    stopping = MedianStopping(trialId, reports, window=sweep.get("rolling_window", 100),
+                              reportEvery=sweep.get("report_every", 100), minEpochs=sweep.get("min_epochs", 0),
+                              minTrials=sweep.get("min_trials", 2))
+    start = time.perf_counter()
+    agent = Agent(parameters)
+    agent.train(maxEpochs=sweep["max_epochs"], callback=stopping)
+
+    return dict(trial, trial=trialId, seed=parameters["seed"], epochs=agent.epoch, stopped=stopping.stopped,
+                best_pipes=stopping.best, final_pipes=stopping.rolling(), seconds=time.perf_counter() - start)
+
+
+def printTable(results, keys):
+    columns = ["trial", *keys, "epochs", "stopped", "best_pipes", "final_pipes", "seconds"]
+    rows = [[f"{r[c]:.4g}" if isinstance(r[c], float) else str(r[c]) for c in columns] for r in results]
+    widths = [max(len(c), *(len(row[i]) for row in rows)) for i, c in enumerate(columns)]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(v.ljust(w) for v, w in zip(row, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Flappy Bird DQN hyperparameter sweep")
+    parser.add_argument("sweep", nargs="?", default="sweep.yml")
+    parser.add_argument("--workers", type=int, default=None, help="overrides the sweep file's workers")
+    args = parser.parse_args()
+
+    with open(args.sweep, "r") as sweep_file:
+        sweep = yaml.safe_load(sweep_file)
+    with open("hyperparameters.yml", "r") as parameters_file:
+        parameters = yaml.safe_load(parameters_file)
+
+    trials = makeTrials(sweep)
+    keys = sorted({key for trial in trials for key in trial})
+    directory = os.path.join(sweep.get("directory", "./sweeps"), sweep["name"])
+    os.makedirs(directory, exist_ok=True)
+    workers = args.workers or sweep.get("workers", os.cpu_count())
+    print(f"{len(trials)} trials on {workers} workers, writing to {directory}")
+
+    # spawn, so the workers don't inherit TensorFlow state
+    context = mp.get_context("spawn")
+    with context.Manager() as manager, context.Pool(workers, maxtasksperchild=1) as pool:
+        reports = manager.dict()
+        pending = [pool.apply_async(runTrial, (trialId, trial, parameters, sweep, directory, reports))
+                   for trialId, trial in enumerate(trials)]
+        results = [result.get() for result in pending]
+
+    results.sort(key=lambda r: r["final_pipes"], reverse=True)
+    table = MetricsLogger(os.path.join(directory, "results.csv"),
+                          ["trial", "seed", *keys, "epochs", "stopped", "best_pipes", "final_pipes", "seconds"])
+    for result in results:
+        table.log(result["trial"], **result)
+    table.close()
+    printTable(results, keys)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import numpy as np
+from flappybirdenv.flappybird import FlappyBird
+from flappybirdenv.flappybird_vector import VectorFlappyBird
+from flappybirdenv.flappybird_rewards import getReward
+
+
+def play(game, actions):
+    results = []
+    for action in actions:
+        results.append((game.step(action), game.getGameState(), game.snapshot()))
+        if results[-1][0][0]:
+            game.resetGame()
+    return results
+
+
+def test_snapshot_restore_replays_identically():
+    game = FlappyBird(headless=True, seed=3)
+    actions = (np.random.default_rng(0).random(600) < 0.08).astype(int)
+    play(game, actions[:100])
+    snapshot = game.snapshot()
+    expected = play(game, actions[100:])
+
+    # restored in the same game and in another one, the games play the same frames again
+    for other in (game, FlappyBird(headless=True, seed=7)):
+        other.restore(snapshot)
+        assert other.snapshot() == snapshot
+        assert play(other, actions[100:]) == expected
+
+
+# copy the pipes of a FlappyBird into game 0 of a VectorFlappyBird, whose pipes come from another generator
+def copyPipes(vector, game):
+    for i, (x, size, has_portal, reward_taken, portal_taken) in enumerate(game.snapshot().pipes):
+        vector.pipeX[0, i] = x
+        vector.pipeSize[0, i] = size
+        vector.hasPortal[0, i] = has_portal
+        vector.rewardTaken[0, i] = reward_taken
+        vector.portalTaken[0, i] = portal_taken
+
+
+# flaps when the bird falls below the gap, so games pass pipes and enter portals
+def followGap(state):
+    return int(state[3] + 24 > state[1] - 15 and state[4] >= 0)
+
+
+def test_vector_env_matches_flappybird():
+    vector = VectorFlappyBird(1, seed=0)
+    frames = scores = portals = 0
+    for seed in range(10):
+        game = FlappyBird(headless=True, seed=seed)
+        vector.reset()
+        copyPipes(vector, game)
+        np.testing.assert_array_equal(vector.getGameStates()[0], np.float32(game.getGameState()))
+
+        gameOver = False
+        while not gameOver:
+            action = followGap(game.getGameState())
+            gameOver, gotReward, portalReward = game.step(action)
+            states, rewards, dones = vector.step([action])
+            frames += 1
+            portals += portalReward
+            assert dones[0] == gameOver
+            assert rewards[0] == np.float32(getReward(gameOver, gotReward, portalReward))
+            if gameOver:
+                assert vector.finishedScores[0] == game.score
+                scores += game.score
+                break
+            # pipes spawned during the frame are random in both, they can't be hit before the next frame
+            copyPipes(vector, game)
+            np.testing.assert_array_equal(states[0], np.float32(game.getGameState()))
+            assert vector.scores[0] == game.score
+    assert frames > 1000 and scores > 0 and portals > 0
@@ -0,0 +1,123 @@
+import numpy as np
+from replay import SumTree, PrioritizedReplayMemory, MemmapReplayMemory, NStepBuffer
+
+
+def transitions(count, offset=0):
+    states = np.arange(offset, offset + count, dtype=np.float32)[:, None].repeat(5, axis=1)
+    return (states, np.arange(count) % 2, np.ones(count), states + 1, np.zeros(count, dtype=bool),
+            np.full(count, 0.99))
+
+
+def test_sumtree_update_and_find():
+    tree = SumTree(5)
+    values = np.array([1., 0., 3., 2., 4.])
+    tree.update(np.arange(5), values)
+    tree.set(1, 5.)
+    values[1] = 5.
+    assert tree.total() == values.sum()
+    np.testing.assert_array_equal(tree.get(np.arange(5)), values)
+
+    # every value falls in the leaf whose cumulative range holds it, empty leaves are never found
+    bounds = np.cumsum(values)
+    points = np.linspace(0, values.sum(), 1000, endpoint=False)
+    np.testing.assert_array_equal(tree.find(points), np.searchsorted(bounds, points, side="right"))
+
+
+def test_prioritized_sampling_proportions():
+    memory = PrioritizedReplayMemory(8, alpha=0.5, beta=1., betaIncrement=0., seed=0)
+    memory.addBatch(*transitions(8))
+    tdErrors = np.array([1., 4., 9., 16., 0., 1., 4., 9.])
+    memory.updatePriorities(np.arange(8), tdErrors)
+    assert memory.maxPriority == 16 + memory.epsilon
+
+    counts = np.zeros(8)
+    for _ in range(2000):
+        indices, _, weights = memory.sample(32)
+        counts += np.bincount(indices, minlength=8)
+    expected = (tdErrors + memory.epsilon) ** 0.5
+    np.testing.assert_allclose(counts / counts.sum(), expected / expected.sum(), atol=0.01)
+
+    # with beta = 1 the importance sampling weights undo the sampling probabilities
+    indices, _, weights = memory.sample(8)
+    probabilities = memory.priorities.get(indices) / memory.priorities.total()
+    np.testing.assert_allclose(weights, (1 / probabilities) / (1 / probabilities).max(), rtol=1e-5)
+
+
+# the lambda-return of every frame, computed one return at a time
+def lambdaReturns(rewards, values, n, gamma, lam, gameOver):
+    size = len(rewards)
+    results = []
+    for t in range(size if gameOver else size - n + 1):
+        horizon = min(n, size - t)
+        total = 0.
+        for k in range(1, horizon + 1):
+            kStep = sum(gamma ** i * rewards[t + i] for i in range(k))
+            if k < horizon:
+                total += (1 - lam) * lam ** (k - 1) * (kStep + gamma ** k * values[t + k - 1])
+            else:
+                total += lam ** (k - 1) * kStep
+        done = gameOver and t + horizon == size
+        results.append((total, t + horizon - 1, lam ** (horizon - 1) * gamma ** horizon * (not done), done))
+    return results
+
+
+def test_lambda_returns_match_reference():
+    rng = np.random.default_rng(0)
+    gamma, lam, n = 0.9, 0.7, 4
+    for size, gameOver in ((9, True), (2, True), (8, False)):
+        rewards = rng.normal(size=size)
+        nextStates = rng.normal(size=(size, 5)).astype(np.float32)
+        values = nextStates.sum(axis=1).astype(np.float64)
+        buffer = NStepBuffer(n, gamma, lam=lam, valueFn=lambda states: states.sum(axis=1),
+                             window=max(size, n))
+
+        batch = None
+        for t in range(size):
+            batch = buffer.add(np.zeros(5), 0, rewards[t], nextStates[t], gameOver and t == size - 1)
+        if batch is None:
+            batch = buffer.flush(gameOver)
+        _, _, returns, batchNext, dones, discounts = batch
+
+        expected = lambdaReturns(rewards, values, n, gamma, lam, gameOver)
+        np.testing.assert_allclose(returns, [e[0] for e in expected], rtol=1e-5, atol=1e-5)
+        np.testing.assert_array_equal(batchNext, nextStates[[e[1] for e in expected]])
+        np.testing.assert_allclose(discounts, [e[2] for e in expected], rtol=1e-6)
+        np.testing.assert_array_equal(dones, [e[3] for e in expected])
+
+
+# the Agent writes every frame's state into the same array, the buffer must keep its own copies
+def test_nstep_next_states_with_reused_arrays():
+    n = 3
+    buffer = NStepBuffer(n, 0.9)
+    state = np.zeros((1, 5))
+    nextState = np.zeros((1, 5))
+
+    batch = None
+    for frame in range(6):
+        state[0] = frame
+        nextState[0] = frame + 1
+        batch = buffer.add(state, 0, 1., nextState, frame == 5)
+
+    states, _, _, nextStates, gameOvers, _ = batch
+    np.testing.assert_array_equal(states[:, 0], np.arange(6))
+    np.testing.assert_array_equal(nextStates[:, 0], np.minimum(np.arange(6) + n, 6))
+    np.testing.assert_array_equal(gameOvers, [False, False, False, True, True, True])
+
+
+def test_memmap_reopen_keeps_size_and_position(tmp_path):
+    path = str(tmp_path / "memory.npy")
+    memory = MemmapReplayMemory(10, path, overwrite=True)
+    memory.addBatch(*transitions(13))
+    memory.close()
+
+    reopened = MemmapReplayMemory(10, path)
+    assert reopened.reopened
+    assert (len(reopened), reopened.position) == (10, 3)
+    np.testing.assert_array_equal(reopened.states[:3, 0], [10, 11, 12])
+    np.testing.assert_array_equal(reopened.states[3:, 0], np.arange(3, 10))
+
+    # the header follows the adds without close(), and overwrite starts from an empty memory
+    unclosed = MemmapReplayMemory(10, path, overwrite=True, flushEvery=4)
+    for i in range(5):
+        unclosed.add(np.zeros(5), 0, 0., np.zeros(5), False, 0.99)
+    assert len(MemmapReplayMemory(10, path)) == 4
@@ -0,0 +1,161 @@
+import struct
+import zlib
+import numpy as np
+from collections import namedtuple
+
+
+# Compact file format for recorded games, used to reuse experience across runs (prefilling the replay memory, or
+# offline training). A file starts with a header and is followed by the games, one after the other:
+#
+#   file header     magic, state size
+#   game header     seed (-1 if unknown), action repeat, decisions, score, number of chunks
+#   chunks          decisions in the chunk, compressed size, then the zlib compressed arrays of the chunk:
+#                   states (float32), actions (uint8), rewards (float32) and flags (uint8, see FLAG_*)
+#   last state      the state after the last decision (float32), uncompressed
+#
+# The next state of a decision is the state of the following one, so every state is only stored once.
+
+FILE_MAGIC = b"FLAPTRJ1"
+FILE_HEADER = struct.Struct("<8sH")
+EPISODE_HEADER = struct.Struct("<qBIII")
+CHUNK_HEADER = struct.Struct("<II")
+
+FLAG_GAME_OVER = 1
+FLAG_PIPE = 2
+FLAG_PORTAL = 4
+
+# a recorded game. states has one more row than the other arrays: the state after the last decision
+Episode = namedtuple("Episode", ["seed", "actionRepeat", "score", "states", "actions", "rewards", "flags"])
+
+
+# Records games to a trajectory file. The decisions of the current game are compressed every chunkSize decisions,
+# and the game is written when it ends.
+class TrajectoryRecorder():
+    def __init__(self, path, stateSize=5, chunkSize=4096, level=6):
+        self.stateSize = stateSize
+        self.chunkSize = chunkSize
+        self.level = level
+        self.file = open(path, "wb")
+        self.file.write(FILE_HEADER.pack(FILE_MAGIC, stateSize))
+        self.episode = None
+
+    # start a new game from state, seed is the one the game was reset with
+    def beginEpisode(self, seed, state, actionRepeat=1):
+        self.episode = (-1 if seed is None else seed, actionRepeat)
+        self.chunks = []
+        self.decisions = 0
+        self.score = 0
+        self._newChunk()
+        self.states.append(np.array(state, dtype=np.float32).reshape(-1))
+
+    def _newChunk(self):
+        self.states = []
+        self.actions = []
+        self.rewards = []
+        self.flags = []
+
+    def _compressChunk(self):
+        arrays = (np.asarray(self.states, dtype=np.float32), np.asarray(self.actions, dtype=np.uint8),
+                  np.asarray(self.rewards, dtype=np.float32), np.asarray(self.flags, dtype=np.uint8))
+        data = zlib.compress(b"".join(array.tobytes() for array in arrays), self.level)
+        self.chunks.append((len(self.actions), data))
+
+    # record a decision and the state it led to
+    def add(self, action, reward, nextState, gameOver, gotPipe=False, gotPortal=False):
+        self.actions.append(action)
+        self.rewards.append(reward)
+        self.flags.append(FLAG_GAME_OVER * bool(gameOver) | FLAG_PIPE * bool(gotPipe) | FLAG_PORTAL * bool(gotPortal))
+        self.decisions += 1
+        self.score += bool(gotPipe)
+
+        # copied, the caller may reuse its state arrays
+        nextState = np.array(nextState, dtype=np.float32).reshape(-1)
+        if len(self.actions) == self.chunkSize:
+            self._compressChunk()
+            self._newChunk()
+        self.states.append(nextState)
+
+        if gameOver:
+            self.endEpisode()
+
+    # write the current game, called by add() when the game is over
+    def endEpisode(self):
+        lastState = self.states.pop()
+        if self.actions:
+            self._compressChunk()
+
+        seed, actionRepeat = self.episode
+        self.file.write(EPISODE_HEADER.pack(seed, actionRepeat, self.decisions, self.score, len(self.chunks)))
+        for decisions, data in self.chunks:
+            self.file.write(CHUNK_HEADER.pack(decisions, len(data)))
+            self.file.write(data)
+        self.file.write(np.asarray(lastState, dtype=np.float32).tobytes())
+        self.episode = None
+
+    # unfinished games are dropped
+    def close(self):
+        self.file.close()
+
+
+# iterate over the games of a trajectory file
+def readEpisodes(path):
+    with open(path, "rb") as f:
+        magic, stateSize = FILE_HEADER.unpack(f.read(FILE_HEADER.size))
+        if magic != FILE_MAGIC:
+            raise ValueError(f"{path} is not a trajectory file")
+
+        while True:
+            header = f.read(EPISODE_HEADER.size)
+            if len(header) < EPISODE_HEADER.size:
+                return
+            seed, actionRepeat, decisions, score, numChunks = EPISODE_HEADER.unpack(header)
+
+            chunks = []
+            for _ in range(numChunks):
+                count, size = CHUNK_HEADER.unpack(f.read(CHUNK_HEADER.size))
+                data = zlib.decompress(f.read(size))
+                sizes = np.cumsum([count * stateSize * 4, count, count * 4])
+                chunks.append((np.frombuffer(data[:sizes[0]], dtype=np.float32).reshape(count, stateSize),
+                               np.frombuffer(data[sizes[0]:sizes[1]], dtype=np.uint8),
+                               np.frombuffer(data[sizes[1]:sizes[2]], dtype=np.float32),
+                               np.frombuffer(data[sizes[2]:], dtype=np.uint8)))
+            lastState = np.frombuffer(f.read(stateSize * 4), dtype=np.float32)
+
+            states, actions, rewards, flags = (np.concatenate(arrays) for arrays in zip(*chunks))
+            yield Episode(None if seed == -1 else seed, actionRepeat, score, np.vstack([states, lastState]),
+                          actions, rewards, flags)
+
+
+# Play a recorded game again in a FlappyBird, from its seed, yielding after every frame. Needs the seed, which
+# recorded games always have when the Agent records them.
+def replayEpisode(game, episode):
+    if episode.seed is None:
+        raise ValueError("the game was recorded without a seed")
+    game.resetGame(episode.seed)
+    # the bird's speed carries over from the previous game
+    game.bird.speed = float(episode.states[0][4])
+    yield
+
+    for action in episode.actions:
+        for _ in range(episode.actionRepeat):
+            gameOver, _, _ = game.step(int(action))
+            yield
+            if gameOver:
+                break
+
+
+# Load the games of trajectory files into a Dqn's replay memory, through its n-step buffer if it has one.
+# Returns the number of transitions read.
+def loadIntoMemory(dqn, paths):
+    transitions = 0
+    for path in paths:
+        for episode in readEpisodes(path):
+            gameOvers = (episode.flags & FLAG_GAME_OVER) != 0
+            if dqn.nStep is None:
+                dqn.rememberBatch(episode.states[:-1], episode.actions, episode.rewards, episode.states[1:], gameOvers)
+            else:
+                for i in range(len(episode.actions)):
+                    dqn.remember([episode.states[i], episode.actions[i], episode.rewards[i], episode.states[i + 1]],
+                                 gameOvers[i])
+            transitions += len(episode.actions)
+    return transitions